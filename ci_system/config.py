@@ -5,6 +5,7 @@ repository polling intervals, heartbeat timeouts, result storage paths, and logg
 """
 
 
+import os
 from pathlib import Path
 
 # Base directory for test results
@@ -23,6 +24,20 @@ TEST_RUNNER_PORT_RANGE = (8900, 9000)
 REPO_POLL_INTERVAL = 5  # Seconds between repository checks
 HEARTBEAT_TIMEOUT = 10  # Seconds before considering a component unresponsive
 RUNNER_CHECK_INTERVAL = 5  # Seconds between runner health checks
+DISPATCH_RETRY_MAX_DELAY = 30  # Max seconds between dispatch retries while the dispatcher is down
+
+# TCP keepalive probing, kept well inside HEARTBEAT_TIMEOUT
+KEEPALIVE_IDLE = 2  # Seconds of idle before the first probe
+KEEPALIVE_INTERVAL = 1  # Seconds between probes
+KEEPALIVE_COUNT = 3  # Unanswered probes before the connection is dropped
+# SO_SNDBUF/SO_RCVBUF for CI connections in bytes; None keeps the kernel's autotuning
+SOCKET_BUFFER_SIZE = 1 << 20
+# Test output up to this many bytes is kept in memory and sent inline; larger
+# output is spilled to a temporary file and sent with sendfile
+RESULTS_SPOOL_SIZE = 64 * 1024
+# Directory the spilled output is written to; None uses the system temporary
+# directory. A tmpfs such as "/dev/shm" keeps large output in RAM as well.
+RESULTS_SPOOL_DIR = None
 
 # Logging configuration
 LOG_LEVEL = "INFO"
@@ -31,3 +46,8 @@ LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 # Web reporter settings
 REPORTER_HOST = "0.0.0.0"
 REPORTER_PORT = 5050
+REPORTER_PAGE_SIZE = 50  # Results listed per page
+# Waitress worker threads; requests mostly wait on file reads, so two per CPU
+REPORTER_THREADS = min(32, (os.cpu_count() or 2) * 2)
+REPORTER_CONNECTION_LIMIT = 512  # Open connections accepted before new ones wait
+REPORTER_CHANNEL_TIMEOUT = 30  # Seconds an idle keep-alive connection is held
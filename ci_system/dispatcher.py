@@ -6,35 +6,52 @@ The dispatcher acts as the central coordinator. It listens for:
   - "register" requests (from test runners registering themselves)
   - "dispatch" requests (from the repository observer with a commit ID)
   - "results" requests (from test runners reporting test outcomes)
+  - "error" requests (from test runners that could not test a commit), stored
+    like results so the failure shows on the commit's results page
 
 It also monitors the health of registered test runners and reassigns commits if needed.
+All connections and maintenance work are served by a single asyncio event loop.
 """
 
 import argparse
+import asyncio
+import logging
 import os
-import re
-import threading
 import time
-import socketserver
-from collections import deque
-from pathlib import Path
 
 from ci_system import config, helpers
 
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
+logger = logging.getLogger(__name__)
+
 # Global structures for tracking runners and commit assignments
-# List of dicts: {"host": str, "port": int, "last_seen": float}
-registered_runners = []
+# Mapping (host, port) -> {"host": str, "port": int, "last_seen": float}
+registered_runners = {}
 dispatched_commits = {}       # Mapping commit_id -> runner info
-pending_commits = deque()    # Queue of commit IDs to be dispatched
+# Commit IDs to be dispatched, in arrival order; a dict keeps FIFO order
+# with O(1) membership and removal
+pending_commits = {}
+
+# One lock guards all of the above, so each update is a single acquire
+state_lock = asyncio.Lock()
+# Signalled whenever pending_commits may have work for the redistributor
+pending_cv = asyncio.Condition(state_lock)
+# Signalled whenever a runner may be free to accept a commit
+runners_cv = asyncio.Condition(state_lock)
+
+# Replies sent on every status check, registration and dispatch, encoded once
+OK = b"OK"
+UNKNOWN_COMMAND = b"Unknown command"
 
-# Locks for shared state
-runners_lock = threading.Lock()
-commits_lock = threading.Lock()
+# Open client connections, closed on shutdown
+_connections = set()
+# Strong references to fire-and-forget tasks so they are not garbage collected
+_background_tasks = set()
 
 
-class DispatcherHandler(socketserver.BaseRequestHandler):
+class DispatcherHandler:
     """
-    Handles incoming requests to the dispatcher server.
+    Handles incoming requests on a single connection to the dispatcher server.
 
     Commands and their expected arguments:
     - "status": No argument required. Used to check if the dispatcher is available.
@@ -45,46 +62,82 @@ class DispatcherHandler(socketserver.BaseRequestHandler):
         - result length (integer)
         - result data (string)
       Format: "commit_id:length:result_data"
+      The result data is streamed to disk rather than buffered in memory.
     """
 
-    BUF_SIZE = 1024
-    COMMAND_REGEX = re.compile(r"(\w+)(:.+)*")
+    BUF_SIZE = 64 * 1024
 
-    def handle(self):
-        try:
-            raw_data = self.request.recv(self.BUF_SIZE).strip().decode()
-            print(f"[Dispatcher] Received: {raw_data}")
-        except Exception as e:
-            self.request.sendall(f"Error receiving data: {e}".encode())
-            return
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        helpers.configure_socket(writer.get_extra_info("socket"))
 
-        match = self.COMMAND_REGEX.match(raw_data)
-        if not match:
-            self.request.sendall("Invalid command".encode())
+    async def handle(self):
+        # The connection stays open for as many framed requests as the peer sends
+        _connections.add(self.writer)
+        try:
+            while True:
+                try:
+                    length = int.from_bytes(
+                        await self.reader.readexactly(helpers.HEADER_SIZE), "big")
+                    # Only the head of a frame is buffered, results bodies are streamed
+                    head = await self.reader.readexactly(min(length, self.BUF_SIZE))
+                    remaining = length - len(head)
+
+                    # Split on the first colon: "command" or "command:argument"
+                    command, sep, argument = head.partition(b":")
+                    if command in (b"results", b"error") and sep:
+                        await self._handle_results(argument, remaining)
+                        continue
+
+                    if remaining:
+                        argument += await self.reader.readexactly(remaining)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    return
+                except Exception as e:
+                    await self._send(f"Error receiving data: {e}")
+                    return
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received: %s", head.decode(errors="replace"))
+                await self._handle_message(command, argument if sep else None)
+        finally:
+            _connections.discard(self.writer)
+            self.writer.close()
+
+    async def _handle_message(self, command, argument):
+        """
+        Route a request by its raw command bytes. The argument is only
+        decoded by the commands that take one.
+        """
+        if not command:
+            await self._send("Invalid command")
             return
 
-        command = match.group(1)  # e.g status, register, dispatch, results
-        argument = match.group(2)[1:] if match.group(
-            2) else None  # extract the argument if any
-
         # Check if the dispatcher is available
-        if command == "status":
-            print("[Dispatcher] Status check received")
-            self.request.sendall("OK".encode())
+        if command == b"status":
+            logger.debug("Status check received")
+            await self._send(OK)
         # Register a new runner
-        elif command == "register":
-            self._handle_register(argument)
+        elif command == b"register":
+            await self._handle_register(
+                argument.decode(errors="replace") if argument else None)
         # Dispatch tests for a commit
-        elif command == "dispatch":
-            self._handle_dispatch(argument)
-        # Receive test results
-        elif command == "results":
-            self._handle_results(argument)
+        elif command == b"dispatch":
+            await self._handle_dispatch(
+                argument.decode(errors="replace") if argument else None)
+        # Results and errors with an argument are streamed by handle()
+        elif command in (b"results", b"error"):
+            await self._send("Missing results data")
 
         else:
-            self.request.sendall("Unknown command".encode())
+            await self._send(UNKNOWN_COMMAND)
+
+    async def _send(self, message):
+        """Send a single framed response (str, or bytes sent as they are) to the peer"""
+        payload = message if isinstance(message, bytes) else message.encode()
+        await helpers.write_message(self.writer, payload)
 
-    def _handle_register(self, argument):
+    async def _handle_register(self, argument):
         """
         Handles the "register" command to register a new test runner.
 
@@ -93,7 +146,7 @@ class DispatcherHandler(socketserver.BaseRequestHandler):
 
         """
         if not argument:
-            self.request.sendall("Missing runner info".encode())
+            await self._send("Missing runner info")
             return
 
         try:
@@ -101,22 +154,26 @@ class DispatcherHandler(socketserver.BaseRequestHandler):
             port = int(port_str)
             runner = {"host": host, "port": port, "last_seen": time.time()}
 
-            with runners_lock:
+            async with state_lock:
                 # Prevent duplicate registrations
-
-                if not any(r["host"] == host and r["port"] == port for r in registered_runners):
-                    registered_runners.append(runner)
-                    print(f"[Dispatcher] Registered runner: {host}:{port}")
-                    self.request.sendall("OK".encode())
-                else:
-                    self.request.sendall("Runner already registered".encode())
+                is_new = (host, port) not in registered_runners
+                if is_new:
+                    registered_runners[(host, port)] = runner
+                    # A new runner may be able to take queued commits right away
+                    runners_cv.notify_all()
+                    pending_cv.notify_all()
+
+            if is_new:
+                logger.info("Registered runner: %s:%s", host, port)
+                await self._send(OK)
+            else:
+                await self._send("Runner already registered")
 
         except Exception as e:
-            error_msg = f"Invalid registration: {e}"
-            print(f"[Dispatcher] {error_msg}")
-            self.request.sendall(error_msg.encode())
+            logger.warning("Invalid registration: %s", e)
+            await self._send(f"Invalid registration: {e}")
 
-    def _handle_dispatch(self, argument):
+    async def _handle_dispatch(self, argument):
         """
         Handles the "dispatch" command to assign a commit to a test runner.
 
@@ -124,169 +181,275 @@ class DispatcherHandler(socketserver.BaseRequestHandler):
         - The commit ID to be dispatched.
         """
         commit_id = argument if argument else ""
-        with runners_lock:
-
-            if not registered_runners:
-                self.request.sendall("No runners available".encode())
-                return
+        if not helpers.is_commit_id(commit_id):
+            await self._send("Invalid commit ID")
+            return
+        if not registered_runners:
+            await self._send("No runners available")
+            return
 
-        self.request.sendall("OK".encode())
-        dispatch_tests(commit_id)
+        await self._send(OK)
+        # Dispatch in the background so the connection can serve further requests
+        _spawn(dispatch_tests(commit_id))
 
-    def _handle_results(self, argument):
+    async def _handle_results(self, head, remaining):
         """
-        Handles the "results" command to receive test results from a runner.
+        Handles the "results" command to receive test results from a runner,
+        and the "error" command, whose error report is stored the same way.
 
-        Argument:
-        - A string containing the commit ID, result length, and result data.
+        Arguments:
+        - head: the buffered start of the argument, holding the commit ID,
+          result length (in bytes) and the first part of the result data.
+        - remaining: the number of result bytes still to be read from the stream.
         """
 
-        if not argument:
-            self.request.sendall("Missing results data".encode())
+        # Locate the two separators instead of split() so the buffered start
+        # of the result data is written through a view rather than copied
+        id_end = head.find(b":")
+        length_end = head.find(b":", id_end + 1) if id_end >= 0 else -1
+        if length_end < 0:
+            await self._discard(remaining)
+            await self._send("Missing results data" if not head else "Invalid results format")
             return
 
-        parts = argument.split(":", 2)
-        if len(parts) < 3:
-            self.request.sendall("Invalid results format".encode())
+        commit_id = head[:id_end].decode(errors="replace")
+        if not helpers.is_commit_id(commit_id):
+            await self._discard(remaining)
+            await self._send("Invalid commit ID")
             return
-
-        commit_id, length_str, result_data = parts
         try:
-            expected_length = int(length_str)
+            expected_length = int(head[id_end + 1:length_end])
         except ValueError:
-            self.request.sendall("Invalid length in results".encode())
+            expected_length = -1
+        result_data = memoryview(head)[length_end + 1:]
+
+        if expected_length != len(result_data) + remaining:
+            await self._discard(remaining)
+            await self._send("Invalid length in results")
             return
 
-        # Collect complete result data
-        while len(result_data) < expected_length:
+        logger.debug("Received: results:%s:%s", commit_id, expected_length)
+        try:
+            file_path = helpers.result_path(commit_id)
+            html_path = helpers.result_html_path(commit_id)
+            # Written under hidden names and renamed into place when complete,
+            # so the reporter never lists a partial file
+            tmp_path = file_path.with_name(f".{commit_id}.tmp")
+            html_tmp_path = file_path.with_name(f".{commit_id}.html.tmp")
             try:
-                extra = self.request.recv(self.BUF_SIZE).decode()
-                result_data += extra
-            except Exception as e:
-                error_msg = f"Error receiving results: {e}"
-                self.request.sendall(error_msg.encode())
-                return
+                f_obj = open(tmp_path, "wb")
+            except FileNotFoundError:
+                # First result in this shard; TEST_RESULTS_DIR itself is
+                # created by config at import
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                f_obj = open(tmp_path, "wb")
+            try:
+                html_obj = open(html_tmp_path, "wb")
+            except BaseException:
+                f_obj.close()
+                tmp_path.unlink(missing_ok=True)
+                raise
+        except Exception as e:
+            await self._discard(remaining)
+            logger.error("Error saving results: %s", e)
+            await self._send(f"Error saving results: {e}")
+            return
 
+        # Write the data as it arrives, along with its HTML-escaped form for
+        # the reporter, so results are escaped once rather than on each view.
+        # A failure here leaves the stream unusable, so it propagates and the
+        # connection is closed
         try:
-
-            # os.makedirs(config.TEST_RESULTS_DIR, exist_ok=True)
-            # file_path = os.path.join(config.TEST_RESULTS_DIR, commit_id)
-            # Handle for multiple OS compatibility
-            Path(config.TEST_RESULTS_DIR).mkdir(parents=True, exist_ok=True)
-            file_path = config.TEST_RESULTS_DIR / commit_id
-
-
-            with open(file_path, "w") as f_obj:
+            with f_obj, html_obj:
                 f_obj.write(result_data)
-
-            with commits_lock:
-                if commit_id in dispatched_commits:
-                    del dispatched_commits[commit_id]
-
-            print(f"[Dispatcher] Results received for commit {commit_id}")
-            self.request.sendall("OK".encode())
-
-        except Exception as e:
-            error_msg = f"Error saving results: {e}"
-            print(f"[Dispatcher] {error_msg}")
-            self.request.sendall(error_msg.encode())
-
-
-class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    allow_reuse_address = True
-    dead = False  # Shutdown flag
-
-
-def runner_checker(server):
-    """Periodically verify runner health with thread-safe operations"""
-    while not server.dead:
-        time.sleep(1)
-
-        # Create safe snapshot of runners
-        with runners_lock:
-            current_runners = list(registered_runners)
-
-        for runner in current_runners:
-            try:
-                response = helpers.communicate(
-                    runner["host"], runner["port"], "ping")
-                if response != "pong":
-                    print(
-                        f"[Dispatcher] Removing unresponsive runner: {runner['host']}:{runner['port']}")
-                    remove_runner(runner)
-            except Exception as e:
-                print(
-                    f"[Dispatcher] Connection failed to {runner['host']}:{runner['port']}: {e}")
-                remove_runner(runner)
-
-
-def remove_runner(runner):
+                html_obj.write(escape_html(result_data))
+                while remaining:
+                    chunk = await self.reader.read(min(remaining, self.BUF_SIZE))
+                    if not chunk:
+                        raise ConnectionError("Connection closed mid-results")
+                    f_obj.write(chunk)
+                    html_obj.write(escape_html(chunk))
+                    remaining -= len(chunk)
+            # The fragment goes first, so it exists whenever the result does
+            os.replace(html_tmp_path, html_path)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            html_tmp_path.unlink(missing_ok=True)
+            raise
+
+        async with state_lock:
+            dispatched_commits.pop(commit_id, None)
+            # The reporting runner is free again for any waiting dispatch
+            runners_cv.notify_all()
+
+        logger.info("Results received for commit %s", commit_id)
+        await self._send(OK)
+
+    async def _discard(self, remaining):
+        """Skip the unread rest of a frame so the next request starts in sync"""
+        while remaining:
+            chunk = await self.reader.read(min(remaining, self.BUF_SIZE))
+            if not chunk:
+                raise ConnectionError("Connection closed mid-frame")
+            remaining -= len(chunk)
+
+
+def escape_html(data):
+    """
+    HTML-escape raw bytes, as html.escape() does for str. The escaped
+    characters are all ASCII, which never occurs inside a multi-byte UTF-8
+    sequence, so chunks can be escaped wherever the stream splits them.
+    """
+    return (bytes(data).replace(b"&", b"&amp;").replace(b"<", b"&lt;")
+            .replace(b">", b"&gt;").replace(b'"', b"&quot;").replace(b"'", b"&#x27;"))
+
+
+def _spawn(coro):
+    """Run a coroutine in the background, keeping a reference until it finishes"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def runner_checker(server):
+    """Periodically verify runner health"""
+    while server.is_serving():
+        await asyncio.sleep(1)
+
+        # Snapshot the runners; the pings below yield to other tasks
+        current_runners = list(registered_runners.values())
+
+        # Ping every runner at once so a dead runner cannot delay the others
+        responses = await asyncio.gather(
+            *(asyncio.wait_for(
+                helpers.async_communicate(runner["host"], runner["port"], "ping"),
+                timeout=config.HEARTBEAT_TIMEOUT)
+              for runner in current_runners),
+            return_exceptions=True)
+
+        for runner, response in zip(current_runners, responses):
+            if isinstance(response, BaseException):
+                logger.warning("Connection failed to %s:%s: %r",
+                               runner["host"], runner["port"], response)
+                await remove_runner(runner)
+            elif response != "OK:pong":
+                logger.warning("Removing unresponsive runner: %s:%s",
+                               runner["host"], runner["port"])
+                await remove_runner(runner)
+
+
+async def remove_runner(runner):
     """Safely remove runner and requeue its commits"""
-    with runners_lock:
-        try:
-            registered_runners.remove(runner)
-            print(
-                f"[Dispatcher] Removed runner: {runner['host']}:{runner['port']}")
-        except ValueError:
+    key = (runner["host"], runner["port"])
+    requeued = []
+    async with state_lock:
+        # A stale snapshot must not evict a runner that has since re-registered
+        if registered_runners.get(key) is not runner:
             return
+        del registered_runners[key]
 
-    requeued = []
-    with commits_lock:
         # Find and requeue affected commits
         for commit_id, assigned in list(dispatched_commits.items()):
-            if assigned == runner:
+            if assigned is runner:
                 del dispatched_commits[commit_id]
-                pending_commits.append(commit_id)
+                pending_commits[commit_id] = None
                 requeued.append(commit_id)
+        if requeued:
+            pending_cv.notify_all()
 
+    logger.info("Removed runner: %s:%s", runner["host"], runner["port"])
     if requeued:
-        print(f"[Dispatcher] Re-queued commits: {requeued}")
+        logger.info("Re-queued commits: %s", requeued)
 
 
-def redistribute(server):
-    """Process pending commits in batches with thread-safe operations"""
-    while not server.dead:
-        time.sleep(1)
-
+async def redistribute(server):
+    """Process pending commits in batches, waking only when work is queued"""
+    while server.is_serving():
         # Get all pending commits atomically
-        with commits_lock:
+        async with pending_cv:
+            while not pending_commits and server.is_serving():
+                try:
+                    await asyncio.wait_for(pending_cv.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
             current_pending = list(pending_commits)
             pending_commits.clear()
 
         for commit_id in current_pending:
-            print(f"[Dispatcher] Re-dispatching {commit_id}")
-            dispatch_tests(commit_id)
+            # Skip commits that another dispatch already placed meanwhile
+            if commit_id in dispatched_commits:
+                continue
+            logger.info("Re-dispatching %s", commit_id)
+            await dispatch_tests(commit_id)
 
 
-def dispatch_tests(commit_id):
-    """Find and assign runner for commit with thread safety"""
+async def dispatch_tests(commit_id):
+    """Find and assign runner for commit"""
     while True:
         # Get current runner snapshot
-        with runners_lock:
-            available_runners = list(registered_runners)
+        available_runners = list(registered_runners.values())
 
+        # Runners are tried one at a time: a runner that answers OK has already
+        # started testing, so a concurrent fan-out would run the commit repeatedly.
         for runner in available_runners:
             try:
-                response = helpers.communicate(
-                    runner["host"],
-                    runner["port"],
-                    f"runtest:{commit_id}"
-                )
-                if response == "OK":
-                    with commits_lock:  # Atomic state update
+                response = await asyncio.wait_for(
+                    helpers.async_communicate(
+                        runner["host"],
+                        runner["port"],
+                        f"runtest:{commit_id}"
+                    ),
+                    timeout=config.HEARTBEAT_TIMEOUT)
+                if response == "OK:OK":
+                    async with state_lock:  # Atomic state update
                         dispatched_commits[commit_id] = runner
-                        try:
-                            # Remove from pending if still present
-                            pending_commits.remove(commit_id)
-                        except ValueError:
-                            pass
-                    print(
-                        f"[Dispatcher] Dispatched {commit_id} to {runner['host']}:{runner['port']}")
+                        pending_commits.pop(commit_id, None)
+                    logger.info("Dispatched %s to %s:%s",
+                                commit_id, runner["host"], runner["port"])
                     return
             except Exception as e:
-                print(f"[Dispatcher] Dispatch error to {runner['host']}: {e}")
+                logger.warning("Dispatch error to %s: %r", runner["host"], e)
 
-        time.sleep(2)
+        # Retry as soon as a runner registers or frees up, or after 2s at most
+        async with runners_cv:
+            try:
+                await asyncio.wait_for(runners_cv.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def handle_connection(reader, writer):
+    """asyncio.start_server callback: serve one client connection"""
+    await DispatcherHandler(reader, writer).handle()
+
+
+async def _serve(host, port):
+    """Run the dispatcher server and its maintenance tasks on the event loop"""
+    server = await asyncio.start_server(
+        handle_connection, host, port, reuse_address=True)
+    logger.info("Running on %s:%s", host, port)
+
+    # Start maintenance tasks
+    runner_task = asyncio.create_task(runner_checker(server))
+    redistributor_task = asyncio.create_task(redistribute(server))
+
+    try:
+        # Serve until cancelled by Ctrl+C. serve_forever() is avoided because on
+        # cancellation it waits for open connections before this cleanup can close them.
+        await asyncio.Event().wait()
+    finally:
+        logger.info("Initiating graceful shutdown...")
+        server.close()
+        # Persistent client connections would otherwise keep wait_closed() pending
+        for writer in list(_connections):
+            writer.close()
+        await server.wait_closed()
+
+        runner_task.cancel()
+        redistributor_task.cancel()
+        await asyncio.gather(runner_task, redistributor_task, return_exceptions=True)
 
 
 def serve():
@@ -299,33 +462,12 @@ def serve():
                         help="Dispatcher port (default: 8888)")
     args = parser.parse_args()
 
-    server = ThreadingTCPServer((args.host, args.port), DispatcherHandler)
-    print(f"[Dispatcher] Running on {args.host}:{args.port}")
-
     try:
-        # Start maintenance threads (non-daemon)
-        runner_thread = threading.Thread(target=runner_checker, args=(server,))
-        redistributor_thread = threading.Thread(
-            target=redistribute, args=(server,))
-
-        runner_thread.start()
-        redistributor_thread.start()
-
-        server.serve_forever()
-
+        asyncio.run(_serve(args.host, args.port))
     except KeyboardInterrupt:
-        print("\n[Dispatcher] Initiating graceful shutdown...")
-        server.dead = True
-        server.shutdown()
-
-        # Allow threads to finish current operations
-        runner_thread.join(timeout=2)
-        redistributor_thread.join(timeout=2)
-
+        pass
     finally:
-        server.server_close()
-        print("[Dispatcher] Server shut down complete")
-
+        logger.info("Server shut down complete")
 
 if __name__ == "__main__":
     serve()
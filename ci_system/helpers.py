@@ -1,43 +1,295 @@
 """
 Provides the utilities(functions) need for the CI system:
-    - communicate
+    - communicate / async_communicate
+    - send_message / recv_message
+    - read_message / write_message (asyncio streams)
+    - configure_socket
+    - is_commit_id / result_path / result_html_path
     - run-command
+
+Every message on the wire is framed as a 4-byte big-endian length followed by
+the payload, so a single TCP connection can carry many request/response pairs.
 """
 
+import asyncio
+import os
+import re
 import socket
 import subprocess
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
+
+from ci_system import config
+
+HEADER_SIZE = 4
+
+# Idle keep-alive connections, one per (host, port)
+_pool: Dict[Tuple[str, int], socket.socket] = {}
+_pool_lock = threading.Lock()
+
+# Idle asyncio connections per (host, port); only touched from the event loop
+_async_pool: Dict[Tuple[str, int],
+                  List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+
+
+def send_message(sock: socket.socket, payload: bytes) -> None:
+    """Send a single length-prefixed frame"""
+    sock.sendall(len(payload).to_bytes(HEADER_SIZE, "big") + payload)
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytes:
+    """
+    Read exactly size bytes from the socket
+    :raises ConnectionError: if the peer closes the connection first
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if not n:
+            raise ConnectionError("Connection closed by peer")
+        received += n
+    return bytes(buf)
+
+
+def recv_message(sock: socket.socket) -> bytes:
+    """
+    Read a single length-prefixed frame and return its payload
+    :raises ConnectionError: if the peer closes the connection
+    """
+    length = int.from_bytes(recv_exact(sock, HEADER_SIZE), "big")
+    return recv_exact(sock, length)
+
+
+def set_keepalive(sock: socket.socket) -> None:
+    """
+    Enable TCP keepalive with probe timings from config, so a silently dead
+    peer is detected within HEARTBEAT_TIMEOUT instead of the kernel defaults
+    (which can be hours). Options missing on the platform are skipped.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (
+        ("TCP_KEEPIDLE", config.KEEPALIVE_IDLE),
+        ("TCP_KEEPINTVL", config.KEEPALIVE_INTERVAL),
+        ("TCP_KEEPCNT", config.KEEPALIVE_COUNT),
+        ("TCP_USER_TIMEOUT", config.HEARTBEAT_TIMEOUT * 1000),  # Linux only
+    ):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+@lru_cache(maxsize=16)
+def _resolve(host: str, port: int) -> List[Tuple[str, int]]:
+    """
+    Numeric (address, port) candidates for host, resolved once. Connecting
+    to a numeric address skips getaddrinfo's name lookup, and lets asyncio
+    skip its resolver thread.
+    """
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(sockaddr[:2] for *_, sockaddr in infos))
+
+
+def _connect(host: str, port: int) -> socket.socket:
+    """Connect to the first reachable address of (host, port)"""
+    error = None
+    for address in _resolve(host, port):
+        try:
+            # The timeout also bounds every blocking recv on this socket
+            return socket.create_connection(address, timeout=config.HEARTBEAT_TIMEOUT)
+        except OSError as e:
+            error = e
+    _resolve.cache_clear()  # The name may now resolve elsewhere
+    raise error
+
+
+async def _async_connect(host: str, port: int
+                         ) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """asyncio counterpart of _connect()"""
+    error = None
+    for address in _resolve(host, port):
+        try:
+            return await asyncio.open_connection(*address)
+        except OSError as e:
+            error = e
+    _resolve.cache_clear()  # The name may now resolve elsewhere
+    raise error
+
+
+def configure_socket(sock: socket.socket) -> None:
+    """
+    Apply the CI system's TCP options to a connected socket: no Nagle delay,
+    SO_SNDBUF/SO_RCVBUF of SOCKET_BUFFER_SIZE so a large results frame moves
+    in few round trips, and keepalive probing (see set_keepalive).
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if config.SOCKET_BUFFER_SIZE:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.SOCKET_BUFFER_SIZE)
+    set_keepalive(sock)
+
+
+def _get_conn(host: str, port: int) -> socket.socket:
+    """Take the idle pooled connection for (host, port) or open a new one"""
+    with _pool_lock:
+        sock = _pool.pop((host, port), None)
+    if sock is not None:
+        return sock
+
+    sock = _connect(host, port)
+    configure_socket(sock)
+    return sock
+
+
+def _release_conn(host: str, port: int, sock: socket.socket) -> None:
+    """Return a healthy connection to the pool for reuse"""
+    with _pool_lock:
+        if (host, port) not in _pool:
+            _pool[(host, port)] = sock
+            return
+    sock.close()
+
 
 def communicate(host: str, port: int, message: str) -> str:
     """
-        Connect via TCP to the specified host and port.
-        Sends the message and returns the decoded response
+        Send the message to the specified host and port over a pooled
+        keep-alive TCP connection and returns the decoded response.
+        A stale pooled connection is discarded and the request retried once.
 
     :param host: The target hostname or IP
     :param port: The target port
-    :param message: The message to edn
+    :param message: The message to send
     :return:  The decoded response from the remote host.
     :raises Exception: if any error occurs
     """
+    payload = message.encode()
+    for attempt in range(2):
+        sock = None
+        try:
+            sock = _get_conn(host, port)
+            send_message(sock, payload)
+            response = recv_message(sock)
+            _release_conn(host, port, sock)
+            return response.decode()
+        except Exception as e:
+            if sock is not None:
+                sock.close()
+            if attempt:
+                raise Exception(f"Communication error with {host}:{port} - {e}")
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """
+    Read a single length-prefixed frame from an asyncio stream
+    :raises ConnectionError: if the peer closes the connection
+    """
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((host, port))
-        s.sendall(message.encode())
-        response = s.recv(4096)
-        s.close()
-        return response.decode()
-    except Exception as e:
-        raise Exception(f"Communication error with {host}:{port} - {e}")
+        header = await reader.readexactly(HEADER_SIZE)
+        return await reader.readexactly(int.from_bytes(header, "big"))
+    except asyncio.IncompleteReadError:
+        raise ConnectionError("Connection closed by peer")
+
+
+async def write_message(writer: asyncio.StreamWriter, payload: bytes) -> None:
+    """Write a single length-prefixed frame to an asyncio stream"""
+    writer.write(len(payload).to_bytes(HEADER_SIZE, "big") + payload)
+    await writer.drain()
+
+
+async def async_communicate(host: str, port: int, message: str,
+                            file: Optional[IO[bytes]] = None) -> str:
+    """
+        Asyncio counterpart of communicate(): sends the message over an idle
+        pooled connection (or a new one) and returns the decoded response.
+        Concurrent requests to the same peer each get their own connection.
+
+    :param host: The target hostname or IP
+    :param port: The target port
+    :param message: The message to send
+    :param file: Optional binary file whose whole contents follow the message
+        in the same frame. It is sent with loop.sendfile(), so the kernel
+        copies it to the socket without passing through Python.
+    :return:  The decoded response from the remote host.
+    :raises Exception: if any error occurs
+    """
+    payload = message.encode()
+    file_size = 0
+    if file is not None:
+        file.flush()  # sendfile reads the descriptor, not Python's buffer
+        file_size = os.fstat(file.fileno()).st_size
+    idle = _async_pool.setdefault((host, port), [])
+    for attempt in range(2):
+        writer = None
+        try:
+            if idle:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await _async_connect(host, port)
+                configure_socket(writer.get_extra_info("socket"))
+            if file is None:
+                await write_message(writer, payload)
+            else:
+                writer.write((len(payload) + file_size).to_bytes(HEADER_SIZE, "big") + payload)
+                await writer.drain()
+                await asyncio.get_running_loop().sendfile(
+                    writer.transport, file, 0, file_size)
+            response = await read_message(reader)
+            idle.append((reader, writer))
+            return response.decode()
+        except asyncio.CancelledError:
+            # The request is abandoned mid-flight; the stream is out of sync
+            if writer is not None:
+                writer.close()
+            raise
+        except Exception as e:
+            if writer is not None:
+                writer.close()
+            if attempt:
+                raise Exception(f"Communication error with {host}:{port} - {e}")
+
+
+_COMMIT_ID = re.compile(r"[0-9a-fA-F]{2,64}")
+
+
+def is_commit_id(commit_id: str) -> bool:
+    """
+    Whether commit_id is a (possibly abbreviated) hex object name. IDs from
+    the wire name files under TEST_RESULTS_DIR, so anything else, such as an
+    empty ID or one with path separators, must be rejected before use.
+    """
+    return _COMMIT_ID.fullmatch(commit_id) is not None
+
+
+def result_path(commit_id: str) -> Path:
+    """
+    Location of a commit's result file. Results are sharded into
+    subdirectories by the first two characters of the commit ID so no
+    single directory grows with the whole history.
+    """
+    return config.TEST_RESULTS_DIR / commit_id[:2] / commit_id
+
+
+# Suffix of the pre-escaped HTML copy kept next to each result file
+RESULT_HTML_SUFFIX = ".html"
+
+
+def result_html_path(commit_id: str) -> Path:
+    """Location of a commit's result log, HTML-escaped for the reporter"""
+    return config.TEST_RESULTS_DIR / commit_id[:2] / (commit_id + RESULT_HTML_SUFFIX)
 
 
-def run_command(command: str) -> str:
+def run_command(command: List[str]) -> str:
     """
-    Execute a shell command and returns its output
-    :param command: command to execute
+    Execute a command and returns its output. The argv list is run directly,
+    without a /bin/sh in between, so nothing in it is shell-interpreted.
+    :param command: command to execute, as an argv list
     :return: decoded output of the command
     :raises Exception: If the command exits with a non-zero status
     """
     try:
-        output = subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT)
+        output = subprocess.check_output(command, stderr=subprocess.STDOUT)
         return output.decode()
     except subprocess.CalledProcessError as e:
-        raise Exception(f"Command failed: {command}\nOutput: {e.output.decode()}")
\ No newline at end of file
+        raise Exception(f"Command failed: {' '.join(command)}\nOutput: {e.output.decode()}")
@@ -1,20 +1,52 @@
 """
 Monitors a Git repository for new commits.
-Periodically, it invokes a shell script (update_repo.sh) that pulls the latest changes.
-If a new commit is detected (indicated by a .commit_id file),
-the dispatcher triggers a test run for that commit.
+Periodically, it fetches the remote with git (no shell script involved) and
+compares the upstream commit against the last one seen.
+If a new commit is detected, the dispatcher triggers a test run for that commit.
 """
 
 
 import argparse
-import subprocess
 import time
-import socket
-from pathlib import Path
 
 from ci_system import config, helpers
 
 
+def _git(repo: str, *args: str) -> str:
+    """Run a git command inside repo and return its stripped output"""
+    return helpers.run_command(["git", "-C", repo, *args]).strip()
+
+
+def check_for_commit(repo: str, last_commit: str):
+    """
+    Fetch the remote and return the upstream commit ID if it differs from
+    last_commit, otherwise None. The clone is reset to the new commit so it
+    stays in step with the remote, as a pull would.
+    """
+    _git(repo, "fetch", "--quiet")
+    commit = _git(repo, "rev-parse", "@{upstream}")
+    if commit == last_commit:
+        return None
+    _git(repo, "reset", "--hard", "--quiet", commit)
+    return commit
+
+
+def dispatch_commit(host: str, port: int, commit: str) -> str:
+    """
+    Send a dispatch request for the commit in a single round trip and return
+    the dispatcher's response. A failed request means the dispatcher is down,
+    so it is retried with exponential backoff instead of losing the commit.
+    """
+    delay = 1
+    while True:
+        try:
+            return helpers.communicate(host, port, f"dispatch:{commit}")
+        except Exception as err:
+            print(f"Could not contact dispatcher ({err}), retrying in {delay}s")
+            time.sleep(delay)
+            delay = min(delay * 2, config.DISPATCH_RETRY_MAX_DELAY)
+
+
 def scan():
     # Parse command-line arguments.
     parser = argparse.ArgumentParser(
@@ -28,39 +60,26 @@ def scan():
     dispatcher_host, dispatcher_port = args.dispatcher_server.split(":")
     dispatcher_port = int(dispatcher_port)
 
+    try:
+        last_commit = _git(args.repo, "rev-parse", "HEAD")
+    except Exception as err:
+        raise Exception(f"Could not read current commit: {err}")
+
     # Main scanning loop, infinite while loop
     while True:
         try:
-            # Update the repository using the shell script.
-            subprocess.check_output(["./scripts/update_repo.sh", args.repo])
-        except subprocess.CalledProcessError as err:
-            raise Exception("Repository update failed: " + err.output.decode())
-
-        # If a new commit is detected, the update script creates .commit_id.
-        commit_id_file = Path(".commit_id")
-        if commit_id_file.is_file():
-            try:
-                # Ensure dispatcher is available.
-                response = helpers.communicate(
-                    dispatcher_host, dispatcher_port, "status")
-            except socket.error as err:
-                raise Exception("Could not contact dispatcher: " + str(err))
-            if response == "OK":
-                # Read the commit ID from the file.
-                commit = commit_id_file.read_text().strip()
-                # Send a dispatch request for the new commit.
-                dispatch_message = f"dispatch:{commit}"
-                response = helpers.communicate(
-                    dispatcher_host, dispatcher_port, dispatch_message)
-                if response != "OK":
-                    # TODO: add more error handling, the commit might already be dispatched
-                    raise Exception("Dispatcher error: " + response)
-                print(f"Dispatched commit {commit}")
-                # Remove the .commit_id file.
-                commit_id_file.unlink()
-            else:
-                # TODO: add more error handling, the dispatcher might be down
-                raise Exception("Dispatcher returned error: " + response)
+            commit = check_for_commit(args.repo, last_commit)
+        except Exception as err:
+            raise Exception(f"Repository update failed: {err}")
+
+        if commit:
+            last_commit = commit
+            # Send a dispatch request for the new commit.
+            response = dispatch_commit(dispatcher_host, dispatcher_port, commit)
+            if response != "OK":
+                # TODO: add more error handling, the commit might already be dispatched
+                raise Exception("Dispatcher error: " + response)
+            print(f"Dispatched commit {commit}")
         time.sleep(config.REPO_POLL_INTERVAL)
 
 
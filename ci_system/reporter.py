@@ -4,10 +4,16 @@ in TEST_RESULTS_DIR and displays them on a web page. Users can view
 the result of CI test in their browser
 """
 
-from flask import Flask, render_template_string, abort
+from flask import Flask, Response, abort, request, send_file
+from markupsafe import Markup
+from functools import lru_cache
 from pathlib import Path
+import heapq
 import os
-from ci_system import config
+import stat
+import threading
+import time
+from ci_system import config, helpers
 
 app = Flask(__name__)
 app.config['TEST_RESULTS_DIR'] = config.TEST_RESULTS_DIR
@@ -53,6 +59,15 @@ HTML_TEMPLATE = """
                     </a>
                     {% endfor %}
                 </div>
+                {% if pages and pages > 1 %}
+                <nav class="mt-3">
+                    <ul class="pagination justify-content-center">
+                        {% for p in range(1, pages + 1) %}
+                        <li class="page-item {{ 'active' if p == page }}"><a class="page-link" href="/?page={{ p }}">{{ p }}</a></li>
+                        {% endfor %}
+                    </ul>
+                </nav>
+                {% endif %}
             {% else %}
                 <div class="alert alert-info">No test results available yet</div>
             {% endif %}
@@ -60,11 +75,11 @@ HTML_TEMPLATE = """
         
         {% if result %}
         <div class="test-results mt-4">
-            <h3>Results for {{ result.commit_id }}</h3>
+            <h3>Results for {{ result.commit_id }} <small><a href="/results/{{ result.commit_id }}/raw">raw</a></small></h3>
             <div class="alert alert-{{ 'success' if result.passed else 'danger' }}">
                 Test suite {{ "passed" if result.passed else "failed" }}
             </div>
-            <pre><code>{{ result.content }}</code></pre>
+            <pre><code>{% for chunk in result.content %}{{ chunk }}{% endfor %}</code></pre>
         </div>
         {% endif %}
     </div>
@@ -72,67 +87,219 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def get_commit_info(commit_id):
-    """Extract test result metadata"""
-    file_path = config.TEST_RESULTS_DIR / commit_id
-    if not file_path.exists():
-        return None
-        
-    with open(file_path, 'r') as f:
-        content = f.read()
-        
+NOT_FOUND_TEMPLATE = """
+        <div class="container mt-5">
+            <div class="alert alert-danger">
+                <h4>Commit not found</h4>
+                <p>The requested test results could not be found</p>
+            </div>
+        </div>
+    """
+
+# Compile the templates once at import instead of on every request
+_TEMPLATE = app.jinja_env.from_string(HTML_TEMPLATE)
+# The 404 page has no variables, so it is rendered once as well
+_404_PAGE = app.jinja_env.from_string(NOT_FOUND_TEMPLATE).render()
+
+# Size of the reads a result log is streamed in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# unittest ends its report with "OK ..." or "FAILED (...)", so only the tail is read
+STATUS_TAIL_BYTES = 512
+
+@lru_cache(maxsize=4096)
+def _read_cached(path: str, mtime_ns: int, ctime: float) -> dict:
+    """
+    Parse result metadata from a file. The mtime is part of the cache key,
+    so an entry goes stale as soon as the dispatcher rewrites the file.
+    """
+    with open(path, 'rb') as f:
+        try:
+            f.seek(-STATUS_TAIL_BYTES, os.SEEK_END)
+        except OSError:  # File is shorter than the tail
+            f.seek(0)
+        last_line = f.read().rstrip().rsplit(b'\n', 1)[-1]
+
     return {
-        'id': commit_id,
-        'status': 'passed' if 'OK' in content else 'failed',
-        'date': os.path.getctime(file_path),
-        'content': content
+        'id': os.path.basename(path),
+        'status': 'passed' if last_line.startswith(b'OK') else 'failed',
+        'date': ctime,
     }
 
+def get_commit_info(commit_id):
+    """
+    Extract test result metadata. The ID comes from the URL, so anything
+    but a hex object name (a path, or a stored .html fragment) is no result.
+    """
+    if not helpers.is_commit_id(commit_id):
+        return None
+    file_path = helpers.result_path(commit_id)
+    try:
+        st = file_path.stat()
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    return _read_cached(str(file_path), st.st_mtime_ns, st.st_ctime)
+
+# Shard directory path -> (mtime_ns, [(ctime, name, path, mtime_ns), ...])
+# from its last scan
+_shard_listings = {}
+
+# A directory modified this recently may still change within the same
+# timestamp tick, so its listing is not cached yet
+SHARD_SETTLE_NS = 1_000_000_000
+
+def _list_shard(shard):
+    """
+    (ctime, name, path, mtime_ns) of every result in a shard, rescanned only
+    if it changed. The stat comes from the DirEntry, so entries are never
+    stat'ed again to be displayed.
+    """
+    mtime_ns = shard.stat().st_mtime_ns
+    cached = _shard_listings.get(shard.path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    # scandir hands back one DirEntry per file, no per-file Path objects
+    listing = []
+    with os.scandir(shard.path) as it:
+        for e in it:
+            if (e.name.startswith('.') or e.name.endswith(helpers.RESULT_HTML_SUFFIX)
+                    or not e.is_file(follow_symlinks=False)):
+                continue
+            st = e.stat(follow_symlinks=False)
+            listing.append((st.st_ctime, e.name, e.path, st.st_mtime_ns))
+    if time.time_ns() - mtime_ns > SHARD_SETTLE_NS:
+        _shard_listings[shard.path] = (mtime_ns, listing)
+    return listing
+
+# Rendered index pages by (page, page_size), valid while the results
+# directory's shard signature is unchanged. Flask serves requests from
+# several threads, so the cache is swapped under a lock.
+_index_cache = {"signature": None, "pages": {}}
+_index_lock = threading.Lock()
+
+def _render_index(shards, page, page_size):
+    """
+    Render one index page, returning (page, html). A page past the last one
+    is clamped to it, so only pages that exist are ever rendered and cached.
+    """
+    listings = [_list_shard(shard) for shard in shards]
+
+    total = sum(len(listing) for listing in listings)
+    pages = max(1, -(-total // page_size))
+    page = min(page, pages)
+
+    # Only the newest entries up to the end of this page are ordered, by
+    # creation date descending, and only the ones shown on it are read
+    start = (page - 1) * page_size
+    entries = heapq.nlargest(start + page_size,
+                             (entry for listing in listings for entry in listing))
+    commits = []
+    for ctime, _, path, mtime_ns in entries[start:]:
+        try:
+            commits.append(_read_cached(path, mtime_ns, ctime))
+        except OSError:  # Removed since the shard was scanned
+            pass
+
+    return page, _TEMPLATE.render(commits=commits, page=page, pages=pages)
+
 @app.route("/")
 def index():
-    commits = []
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = config.REPORTER_PAGE_SIZE
+
+    shards = []
     if config.TEST_RESULTS_DIR.exists():
-        for f in config.TEST_RESULTS_DIR.iterdir():
-            if f.is_file():
-                commit = get_commit_info(f.name)
-                if commit:
-                    commits.append(commit)
-    
-    # Sort by creation date descending
-    commits.sort(key=lambda x: x['date'], reverse=True)
-    
-    return render_template_string(HTML_TEMPLATE, commits=commits)
+        with os.scandir(config.TEST_RESULTS_DIR) as it:
+            shards = [e for e in it if e.is_dir()]
+
+    # Every new or rewritten result is renamed into its shard, which bumps
+    # that shard's mtime, so the mtimes identify the current contents
+    mtimes = [shard.stat().st_mtime_ns for shard in shards]
+    signature = (str(config.TEST_RESULTS_DIR),
+                 tuple(sorted(zip((shard.name for shard in shards), mtimes))))
+    key = (page, page_size)
+    with _index_lock:
+        if _index_cache["signature"] == signature and key in _index_cache["pages"]:
+            return _index_cache["pages"][key]
+
+    page, html = _render_index(shards, page, page_size)
+    key = (page, page_size)
+
+    now = time.time_ns()
+    if all(now - mtime > SHARD_SETTLE_NS for mtime in mtimes):
+        with _index_lock:
+            if _index_cache["signature"] != signature:
+                _index_cache["signature"] = signature
+                _index_cache["pages"] = {}
+            _index_cache["pages"][key] = html
+    return html
 
 @app.route("/results/<commit_id>")
 def show_result(commit_id):
     commit = get_commit_info(commit_id)
     if not commit:
         abort(404)
-        
-    return render_template_string(
-        HTML_TEMPLATE,
+
+    def read_chunks(f, escaped):
+        with f:
+            while chunk := f.read(STREAM_CHUNK_SIZE):
+                yield Markup(chunk) if escaped else chunk
+
+    # Opened here so a vanished file is still a 404, then streamed in chunks
+    # as the template renders instead of being read into memory whole. The
+    # dispatcher stores an escaped copy, so the template has nothing to escape;
+    # results saved before it did are escaped as they stream.
+    try:
+        f = open(helpers.result_html_path(commit_id), 'r', encoding='utf-8',
+                 errors='replace')
+        escaped = True
+    except FileNotFoundError:
+        try:
+            f = open(helpers.result_path(commit_id), 'r', encoding='utf-8',
+                     errors='replace')
+        except OSError:
+            abort(404)
+        escaped = False
+
+    response = Response(_TEMPLATE.generate(
         commits=[commit],  # Show single result in list
         result={
             'commit_id': commit_id,
-            'content': commit['content'],
+            'content': read_chunks(f, escaped),
             'passed': commit['status'] == 'passed'
         }
-    )
+    ), mimetype='text/html')
+    # The rendering may stop before the content is reached (a HEAD request,
+    # or a client that disconnects), so the file is also closed with the
+    # response rather than only by read_chunks
+    response.call_on_close(f.close)
+    return response
+
+@app.route("/results/<commit_id>/raw")
+def show_raw_result(commit_id):
+    """The result log as plain text, sent by the WSGI server's file wrapper"""
+    if not get_commit_info(commit_id):
+        abort(404)
+    return send_file(helpers.result_path(commit_id), mimetype='text/plain')
 
 @app.errorhandler(404)
 def page_not_found(e):
-    return render_template_string("""
-        <div class="container mt-5">
-            <div class="alert alert-danger">
-                <h4>Commit not found</h4>
-                <p>The requested test results could not be found</p>
-            </div>
-        </div>
-    """), 404
+    return _404_PAGE, 404
 
 if __name__ == "__main__":
-    app.run(
+    # Serve concurrent requests over HTTP/1.1 keep-alive connections. Flask's
+    # debug server is not used: its reloader stats every module on a timer
+    # and it exposes the interactive debugger on REPORTER_HOST.
+    from waitress import serve
+    serve(
+        app,
         host=config.REPORTER_HOST,
         port=config.REPORTER_PORT,
-        debug=(config.LOG_LEVEL == "DEBUG")
-    )
\ No newline at end of file
+        threads=config.REPORTER_THREADS,
+        connection_limit=config.REPORTER_CONNECTION_LIMIT,
+        channel_timeout=config.REPORTER_CHANNEL_TIMEOUT,
+    )
@@ -2,54 +2,79 @@
 A Test runner manager that monitors the number of active test runners and
 spawns new ones if the number falls bellow a desired threshold.
 
-It uses subprocess to launch new test runner processes
+Runners are started with multiprocessing from a forkserver that has the runner
+code preloaded, so a replacement runner starts without a fresh interpreter or
+imports, and without inheriting the manager's open file descriptors.
 """
 
 import argparse
 import logging
-import os
-import subprocess
+import multiprocessing
 import time
-from typing import List
+from multiprocessing.connection import wait
+from typing import Dict
 
-from ci_system import config
+from ci_system import config, test_runner
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
+# The forkserver is started once, imports the runner up front, and forks each
+# runner from that clean state. Platforms without it fall back to the default.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _mp_context = multiprocessing.get_context("forkserver")
+    _mp_context.set_forkserver_preload(["ci_system.test_runner"])
+else:
+    _mp_context = multiprocessing.get_context()
+
 class RunnerManager:
     """Manages test runner processes"""
     def __init__(self, repo_path: str, dispatcher_server: str):
         self.repo_path = repo_path
         self.dispatcher_server = dispatcher_server
-        self.processes: List[subprocess.Popen] = []
+        # Runner processes keyed by their sentinel, as reported by wait()
+        self.processes: Dict[int, multiprocessing.Process] = {}
 
     def maintain_pool(self, desired_count: int) -> None:
         """Maintain desired number of runners"""
-        # Clean up terminated processes
-        self.processes = [p for p in self.processes if p.poll() is None]
-        
-        # Spawn new runners if needed
-        while len(self.processes) < desired_count:
+        # One zero-timeout wait over every sentinel finds all exited runners,
+        # instead of querying each process in turn
+        exited = wait(list(self.processes), timeout=0) if self.processes else []
+        for sentinel in exited:
+            proc = self.processes.pop(sentinel)
+            proc.join()  # Reap the exited child
+            proc.close()  # Release its sentinel
+
+        # Spawn new runners if needed; a failed spawn is retried next cycle
+        for _ in range(desired_count - len(self.processes)):
             self._spawn_runner()
-            
+
+    def wait_for_exit(self, desired_count: int) -> None:
+        """
+        Block until a runner exits. Each process sentinel becomes ready when
+        its child dies, so a crashed runner is replaced immediately and the
+        manager does not wake up while the pool is healthy.
+        """
+        if not self.processes:
+            # Nothing to wait on (every spawn failed, or none are wanted)
+            time.sleep(config.RUNNER_CHECK_INTERVAL)
+            return
+        # After a failed spawn, retry on the regular interval instead
+        timeout = None if len(self.processes) >= desired_count else config.RUNNER_CHECK_INTERVAL
+        wait(list(self.processes), timeout)
 
     def _spawn_runner(self) -> None:
         """Launch new test runner process"""
         try:
-            env = os.environ.copy()
-            env["PYTHONPATH"] = "/Users/uzo/Desktop/SWE/Python/CI Project/Dev CI"  # Add the parent directory of ci_system
-            
-            proc = subprocess.Popen([
-                "python", "ci_system/test_runner.py",
-                self.repo_path,
-                "--dispatcher-server", self.dispatcher_server,
-                "--host", config.TEST_RUNNER_HOST,
-            ], env=env)
-            self.processes.append(proc)
-            logger.info(f"Spawned runner PID: {proc.pid}")
+            proc = _mp_context.Process(
+                target=test_runner.run_runner,
+                args=(self.repo_path, config.TEST_RUNNER_HOST, 0, self.dispatcher_server),
+            )
+            proc.start()
+            self.processes[proc.sentinel] = proc
+            logger.info("Spawned runner PID: %s", proc.pid)
         except Exception as e:
-            logger.error(f"Failed to spawn runner: {e}")
+            logger.error("Failed to spawn runner: %s", e)
 
 def main():
     parser = argparse.ArgumentParser(description="Test Runner Manager")
@@ -66,11 +91,13 @@ def main():
     try:
         while True:
             manager.maintain_pool(args.desired_count)
-            time.sleep(config.RUNNER_CHECK_INTERVAL)
+            manager.wait_for_exit(args.desired_count)
     except KeyboardInterrupt:
         logger.info("Shutting down manager")
-        for proc in manager.processes:
+        for proc in manager.processes.values():
             proc.terminate()
+        for proc in manager.processes.values():
+            proc.join()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,74 +3,141 @@
     - "ping": returns "pong" for health checks.
     - "runtest:<commit_id>": upon receiving a commit ID, updates its repository clone,
      runs tests using unittest, and sends the test results back to the dispatcher.
+
+Connections are served on a single asyncio event loop; test runs are handed to a
+worker thread so they never block it.
 """
 
 import argparse
+import asyncio
+import codecs
 import logging
 import os
-import socketserver
 import subprocess
-import threading
+import sys
+import tempfile
 import time
 import unittest
-from typing import Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, Optional, Tuple, Union
 
-from ci_system import helpers
+from ci_system import config, helpers
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logging.basicConfig(level=config.LOG_LEVEL, format=config.LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
-class TestRunnerHandler(socketserver.BaseRequestHandler):
-    """Handles incoming test execution requests"""
-    BUFFER_SIZE = 4096  # For large test results
-    
-    def handle(self) -> None:
+# Replies to the dispatcher's heartbeats and run requests, encoded once
+OK_PONG = b"OK:pong"
+OK_OK = b"OK:OK"
+OK_BUSY = b"OK:BUSY"
+ERROR_UNKNOWN_COMMAND = b"ERROR:Unknown command"
+ERROR_INVALID_COMMIT_ID = b"ERROR:Invalid commit ID"
+
+# Dispatcher replies that mean it failed to store results, so sending them
+# again can succeed; any other reply but OK rejects the results themselves
+TRANSIENT_REPLY_PREFIX = "Error "
+
+class _ReusableSuite(unittest.TestSuite):
+    """A suite that keeps its tests after running, so it can be run again"""
+    _cleanup = False
+
+def _source_signature(repo_folder: str) -> Tuple[Tuple[str, int], ...]:
+    """(path, mtime_ns) of every Python file in the clone, outside .git"""
+    signature = []
+    for root, dirs, files in os.walk(repo_folder):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for name in files:
+            if name.endswith(".py"):
+                path = os.path.join(root, name)
+                signature.append((path, os.stat(path).st_mtime_ns))
+    signature.sort()
+    return tuple(signature)
+
+# The runner's own package, kept loaded even when the clone contains it
+_OWN_PACKAGE = os.path.dirname(os.path.realpath(__file__)) + os.sep
+
+def _purge_modules(repo_folder: str) -> None:
+    """
+    Forget modules imported from the clone. Discovery imports through
+    sys.modules, so without this a later commit would be tested against the
+    code imported for an earlier one. The runner's own modules are kept,
+    for a clone at or above the runner's checkout.
+    """
+    prefix = os.path.realpath(repo_folder) + os.sep
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None)
+        if not path:
+            continue
+        path = os.path.realpath(path)
+        if path.startswith(prefix) and not path.startswith(_OWN_PACKAGE):
+            del sys.modules[name]
+
+class TestRunnerHandler:
+    """Handles incoming test execution requests on one connection"""
+
+    def __init__(self, server: "TestRunnerServer", reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+
+    async def handle(self) -> None:
+        """Serve framed requests until the peer closes the connection"""
+        while True:
+            try:
+                data = (await helpers.read_message(self.reader)).decode()
+            except ConnectionError:
+                return
+            except Exception as e:
+                logger.error("Request receive error: %s", e)
+                return
+            await self._handle_message(data)
+
+    async def _handle_message(self, data: str) -> None:
         try:
-            data = self.request.recv(self.BUFFER_SIZE).decode().strip()
             if ':' in data:
                 command, argument = data.split(':', 1)
             else:
                 command, argument = data, None
 
             if command == "ping":
-                self._handle_ping()
+                await self._handle_ping()
             elif command == "runtest":
-                self._handle_runtest(argument)
+                await self._handle_runtest(argument)
             else:
-                self._send_response("Unknown command", error=True)
+                await self._send_response(ERROR_UNKNOWN_COMMAND)
         except Exception as e:
-            logger.error(f"Request handling error: {e}")
-            self._send_response(f"Internal error: {e}", error=True)
+            logger.error("Request handling error: %s", e)
+            await self._send_response(f"Internal error: {e}", error=True)
 
-    def _handle_ping(self) -> None:
+    async def _handle_ping(self) -> None:
         """Update last communication timestamp"""
         self.server.last_communication = time.time()
-        self._send_response("pong")
+        await self._send_response(OK_PONG)
 
-    def _handle_runtest(self, commit_id: str) -> None:
+    async def _handle_runtest(self, commit_id: Optional[str]) -> None:
         """Handle test execution request"""
+        # The ID is handed to git and echoed in the report, so it must be a
+        # plain object name (not missing, and not an option)
+        if not commit_id or not helpers.is_commit_id(commit_id):
+            await self._send_response(ERROR_INVALID_COMMIT_ID)
+            return
+
+        # Checked and set with no await in between, so only one run can start
         if self.server.busy:
-            self._send_response("BUSY")
+            await self._send_response(OK_BUSY)
             return
 
         self.server.busy = True
-        self._send_response("OK")
-        
-        try:
-            threading.Thread(
-                target=self._execute_test_run,
-                args=(commit_id,),
-                daemon=True
-            ).start()
-        except Exception as e:
-            logger.error(f"Failed to start test thread: {e}")
-            self.server.busy = False
+        self.server.spawn(self._execute_test_run(commit_id))
+        await self._send_response(OK_OK)
 
-    def _execute_test_run(self, commit_id: str) -> None:
+    async def _execute_test_run(self, commit_id: str) -> None:
         """Full test execution workflow"""
         try:
-            self._update_repository(commit_id)
-            results = self._run_test_suite()
+            # The update and the suite block, so they run off the event loop
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.server.test_executor, self._test_commit, commit_id)
             self._report_results(commit_id, results)
         except subprocess.CalledProcessError as e:
             error_msg = f"Repository update failed: {e.output.decode()}"
@@ -81,68 +148,244 @@ class TestRunnerHandler(socketserver.BaseRequestHandler):
         finally:
             self.server.busy = False
 
+    def _test_commit(self, commit_id: str) -> IO[bytes]:
+        """Check out the commit and run its tests; called on the executor thread"""
+        self._update_repository(commit_id)
+        return self._run_test_suite()
+
     def _update_repository(self, commit_id: str) -> None:
-        """Update repository to specified commit"""
-        logger.info(f"Updating to commit {commit_id}")
-        result = subprocess.run(
-            ["./scripts/test_runner_script.sh", self.server.repo_folder, commit_id],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT
-        )
-        logger.debug(f"Update output: {result.stdout.decode()}")
-
-    def _run_test_suite(self) -> str:
-        """Execute tests and return results"""
+        """
+        Update repository to specified commit. git is run directly, without
+        the shell script and its extra bash process per update.
+        """
+        logger.info("Updating to commit %s", commit_id)
+        for args in (
+            ["clean", "-d", "-f", "-x"],  # Clean untracked files
+            ["fetch", "--quiet"],  # The commit may only exist upstream so far
+            ["reset", "--hard", "--quiet", "--end-of-options", commit_id],
+        ):
+            result = subprocess.run(
+                ["git", "-C", self.server.repo_folder, *args],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Update output: %s", result.stdout.decode())
+
+    def _run_test_suite(self) -> IO[bytes]:
+        """Execute tests and return results, as a UTF-8 file positioned at its end"""
         test_dir = os.path.join(self.server.repo_folder, "tests")
-        logger.info(f"Running tests in {test_dir}")
-        
-        with open("test_results.tmp", "w") as f:
-            runner = unittest.TextTestRunner(stream=f, verbosity=2)
-            suite = unittest.TestLoader().discover(test_dir)
-            runner.run(suite)
+        logger.info("Running tests in %s", test_dir)
         
-        with open("test_results.tmp", "r") as f:
-            return f.read()
+        # The loaded suite is reused until a Python file in the clone changes,
+        # so commits that leave the code alone skip discovery and imports
+        signature = _source_signature(self.server.repo_folder)
+        cached = self.server.suite_cache
+        if cached and cached[0] == signature:
+            suite = cached[1]
+        else:
+            _purge_modules(self.server.repo_folder)
+            loader = unittest.TestLoader()
+            loader.suiteClass = _ReusableSuite
+            suite = loader.discover(test_dir)
+            self.server.suite_cache = (signature, suite)
 
-    def _report_results(self, commit_id: str, results: str, error: bool = False) -> None:
-        """Send results to dispatcher"""
-        try:
-            status = "error" if error else "results"
-            response = helpers.communicate(
-                self.server.dispatcher_server["host"],
-                self.server.dispatcher_server["port"],
-                f"{status}:{commit_id}:{len(results)}:{results}"
-            )
-            logger.info(f"Results for {commit_id} {'failed' if error else 'sent'}")
-        except Exception as e:
-            logger.error(f"Failed to report results: {e}")
+        # Collected in a spooled file: kept in memory while small, with no
+        # shared filename for concurrent runners to clobber, and moved to an
+        # anonymous file once large so it can be sent with sendfile
+        output = tempfile.SpooledTemporaryFile(
+            max_size=config.RESULTS_SPOOL_SIZE, dir=config.RESULTS_SPOOL_DIR)
+        stream = codecs.getwriter("utf-8")(output, errors="replace")
+        runner = unittest.TextTestRunner(stream=stream, verbosity=2)
+        runner.run(suite)
+        return output
 
-    def _send_response(self, message: str, error: bool = False) -> None:
-        """Send response to dispatcher"""
+    def _report_results(self, commit_id: str, results: Union[str, IO[bytes]],
+                        error: bool = False) -> None:
+        """
+        Queue results for the server's sender task, so the runner is free
+        for the next commit without waiting on the dispatcher round trip.
+        Results up to RESULTS_SPOOL_SIZE are sent inline; larger result files
+        are queued as they are and sent straight from the kernel.
+        """
+        status = "error" if error else "results"
+        file = None
+        if isinstance(results, str):
+            data = results.encode()
+            size = len(data)
+        else:
+            size = results.tell()
+            if size > config.RESULTS_SPOOL_SIZE:
+                file, data = results, b""
+            else:
+                results.seek(0)
+                data = results.read()
+                results.close()
+        self.server.results_queue.put_nowait(
+            (commit_id, f"{status}:{commit_id}:{size}:{data.decode()}", file))
+
+    async def _send_response(self, message: Union[str, bytes], error: bool = False) -> None:
+        """
+        Send response to dispatcher. A str is sent with its OK:/ERROR: prefix;
+        bytes are one of the prefixed constants above and are sent as they are.
+        """
         try:
-            prefix = "ERROR:" if error else "OK:"
-            self.request.sendall(f"{prefix}{message}".encode())
+            if isinstance(message, str):
+                prefix = "ERROR:" if error else "OK:"
+                message = f"{prefix}{message}".encode()
+            await helpers.write_message(self.writer, message)
         except Exception as e:
-            logger.error(f"Response failed: {e}")
+            logger.error("Response failed: %s", e)
 
-class ThreadedTestRunner(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    """Threaded test runner server"""
-    allow_reuse_address = True
-    daemon_threads = True
-    
-    def __init__(
-        self,
-        server_address: Tuple[str, int],
-        handler_class,
-        repo_folder: str,
-        dispatcher_info: Dict[str, str]
-    ):
-        super().__init__(server_address, handler_class)
+class TestRunnerServer:
+    """
+    Test runner server. Connections are served on a single asyncio event
+    loop, and only the test runs themselves go to a worker thread.
+    """
+
+    def __init__(self, repo_folder: str, dispatcher_info: Dict[str, str]):
         self.repo_folder = repo_folder
         self.dispatcher_server = dispatcher_info
         self.last_communication = time.time()
         self.busy = False
+        # (source signature, loaded suite) from the last run, see _run_test_suite
+        self.suite_cache: Optional[Tuple[tuple, unittest.TestSuite]] = None
+        # One run at a time, so a single worker thread is enough
+        self.test_executor = ThreadPoolExecutor(max_workers=1)
+        # (commit_id, message, file to append or None) waiting to be sent to
+        # the dispatcher
+        self.results_queue: "asyncio.Queue[Tuple[str, str, Optional[IO[bytes]]]]" = \
+            asyncio.Queue()
+        # Open client connections, closed on shutdown
+        self._connections = set()
+        # Strong references to background tasks so they are not garbage collected
+        self._tasks = set()
+
+    def spawn(self, coro) -> "asyncio.Task":
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        """asyncio.start_server callback: serve one client connection"""
+        helpers.configure_socket(writer.get_extra_info("socket"))
+        self._connections.add(writer)
+        try:
+            await TestRunnerHandler(self, reader, writer).handle()
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _send_results(self) -> None:
+        """
+        Send queued results in order, backing off while the dispatcher is
+        unreachable or fails to store them. A result the dispatcher rejects
+        outright would be rejected again, so it is dropped rather than
+        holding up the results queued behind it.
+        """
+        while True:
+            commit_id, message, file = await self.results_queue.get()
+            delay = 1
+            try:
+                while True:
+                    try:
+                        response = await helpers.async_communicate(
+                            self.dispatcher_server["host"],
+                            self.dispatcher_server["port"],
+                            message,
+                            file
+                        )
+                        # "Error saving/receiving ..." is the dispatcher's side failing
+                        if response.startswith(TRANSIENT_REPLY_PREFIX):
+                            raise Exception(f"dispatcher replied {response!r}")
+                    except Exception as e:
+                        logger.error("Failed to report results: %s, retrying in %ss", e, delay)
+                        await asyncio.sleep(delay)
+                        delay = min(delay * 2, config.DISPATCH_RETRY_MAX_DELAY)
+                        continue
+                    if response == "OK":
+                        logger.info("Results for %s sent", commit_id)
+                    else:
+                        logger.error("Dispatcher rejected results for %s: %s",
+                                     commit_id, response)
+                    break
+            finally:
+                if file:
+                    file.close()
+
+    async def _watch_dispatcher(self, register_msg: str) -> None:
+        """
+        Re-register when the dispatcher's pings stop for HEARTBEAT_TIMEOUT,
+        e.g. after it restarted or dropped this runner. Sleeps until exactly
+        the next deadline instead of polling; a ping just moves the deadline.
+        """
+        while True:
+            remaining = config.HEARTBEAT_TIMEOUT - (time.time() - self.last_communication)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+                continue
+
+            logger.warning("No heartbeat from dispatcher, registering again")
+            try:
+                response = await helpers.async_communicate(
+                    self.dispatcher_server["host"], self.dispatcher_server["port"], register_msg)
+                logger.info("Re-registration: %s", response)
+            except Exception as e:
+                logger.error("Re-registration failed: %s", e)
+            # Give the dispatcher a full timeout to resume pinging before retrying
+            self.last_communication = time.time()
+
+    async def serve(self, host: str, port: int) -> None:
+        """Listen on (host, port), register with the dispatcher and serve until cancelled"""
+        server = await asyncio.start_server(
+            self.handle_connection, host, port, reuse_address=True)
+        address = server.sockets[0].getsockname()
+        logger.info("Test runner started on %s:%s", address[0], address[1])
+        try:
+            # Register with dispatcher
+            register_msg = f"register:{host}:{address[1]}"
+            response = await helpers.async_communicate(
+                self.dispatcher_server["host"], self.dispatcher_server["port"], register_msg)
+            if response != "OK":
+                logger.error("Registration failed")
+                return
+
+            self.last_communication = time.time()
+            self.spawn(self._send_results())
+            self.spawn(self._watch_dispatcher(register_msg))
+            # Serve until cancelled; see the dispatcher for why not serve_forever()
+            await asyncio.Event().wait()
+        finally:
+            server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await server.wait_closed()
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            # Also lets the closed connections' handlers run to completion
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.test_executor.shutdown(wait=False, cancel_futures=True)
+
+def run_runner(repo_folder: str, host: str, port: int, dispatcher_server: str) -> None:
+    """
+    Serve as a test runner until interrupted. Usable as a process target, so
+    the runner manager can start runners without launching a new interpreter.
+    """
+    dispatcher_host, dispatcher_port = dispatcher_server.split(":")
+
+    try:
+        server = TestRunnerServer(
+            repo_folder, {"host": dispatcher_host, "port": int(dispatcher_port)})
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        logger.info("Shutting down test runner")
+    except Exception as e:
+        logger.error("Fatal error: %s", e)
 
 def start_test_runner():
     """Main entry point for test runner service"""
@@ -154,30 +397,7 @@ def start_test_runner():
                         help="Dispatcher host:port")
     
     args = parser.parse_args()
-    dispatcher_host, dispatcher_port = args.dispatcher_server.split(":")
-    
-    try:
-        with ThreadedTestRunner(
-            (args.host, args.port),
-            TestRunnerHandler,
-            args.repo_folder,
-            {"host": dispatcher_host, "port": int(dispatcher_port)}
-        ) as server:
-            logger.info(f"Test runner started on {server.server_address[0]}:{server.server_address[1]}")
-            
-            # Register with dispatcher
-            register_msg = f"register:{args.host}:{server.server_address[1]}"
-            response = helpers.communicate(dispatcher_host, int(dispatcher_port), register_msg)
-            if response != "OK":
-                logger.error("Registration failed")
-                return
-                
-            server.serve_forever()
-            
-    except KeyboardInterrupt:
-        logger.info("Shutting down test runner")
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
+    run_runner(args.repo_folder, args.host, args.port, args.dispatcher_server)
 
 if __name__ == "__main__":
     start_test_runner()
\ No newline at end of file
@@ -2,27 +2,68 @@
 tests/integration_test.py
 
 An integration test that simulates the full CI pipeline:
-  - Creates a temporary Git repository with a dummy test.
-  - Commits initial code and then a new change to trigger the CI.
+  - Creates a temporary upstream Git repository with a dummy test, and clones
+    of it for the repository observer and the test runner.
   - Starts the dispatcher, test runner, and repository observer.
-  - Verifies that a test result file is created in the test_results directory.
+  - Commits a new change upstream once the runner has registered.
+  - Verifies that a result file for that commit is created under TEST_RESULTS_DIR.
 """
 
 import unittest
+import socket
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 import os
 
+from ci_system import helpers
+
+# Repository root, so the components can be started as ci_system.* modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until(pred, timeout=15, interval=0.05):
+    """Poll pred until it is true or timeout seconds pass; returns whether it held"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if pred():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def _port_open(host, port):
+    try:
+        socket.create_connection((host, port), timeout=0.05).close()
+        return True
+    except OSError:
+        return False
+
+
+def _git(*args):
+    subprocess.run(["git", *args], check=True, capture_output=True)
+
 
 class IntegrationTest(unittest.TestCase):
+    def start(self, module, *args, **kwargs):
+        proc = subprocess.Popen([sys.executable, "-m", module, *args], cwd=ROOT, **kwargs)
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.terminate)
+        return proc
+
     def test_full_pipeline(self):
-        repo_dir = "temp_integration_repo"
-        os.makedirs(repo_dir, exist_ok=True)
-        subprocess.call(["git", "init", repo_dir])
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        origin_dir = os.path.join(tmp.name, "origin")
+        observer_dir = os.path.join(tmp.name, "observer_clone")
+        runner_dir = os.path.join(tmp.name, "runner_clone")
+        identity = ["-c", "user.name=CI", "-c", "user.email=ci@localhost"]
 
         # Create a dummy test in tests directory.
-        tests_dir = os.path.join(repo_dir, "tests")
-        os.makedirs(tests_dir, exist_ok=True)
+        tests_dir = os.path.join(origin_dir, "tests")
+        os.makedirs(tests_dir)
         with open(os.path.join(tests_dir, "test_dummy.py"), "w") as f:
             f.write("import unittest\n")
             f.write("class DummyTest(unittest.TestCase):\n")
@@ -31,39 +72,49 @@ class IntegrationTest(unittest.TestCase):
             f.write("if __name__ == '__main__':\n")
             f.write("    unittest.main()\n")
 
-        # Initial commit.
-        subprocess.call(["git", "-C", repo_dir, "add", "."])
-        subprocess.call(["git", "-C", repo_dir, "commit", "-m", "Initial commit"])
-
-        # Start dispatcher.
-        dispatcher_proc = subprocess.Popen(
-            ["python", "ci_system/dispatcher.py", "--host", "localhost", "--port", "8888"])
-        # Start test runner.
-        test_runner_proc = subprocess.Popen(
-            ["python", "ci_system/test_runner.py", repo_dir, "--host", "localhost", "--port", "0",
-             "--dispatcher-server", "localhost:8888"])
-        # Start repository observer.
-        observer_proc = subprocess.Popen(
-            ["python", "ci_system/repo_observer.py", "--dispatcher-server", "localhost:8888", repo_dir])
-
-        time.sleep(2)
-        # Make a new commit to trigger CI.
-        with open(os.path.join(repo_dir, "new_file.txt"), "w") as f:
-            f.write("New commit content.\n")
-        subprocess.call(["git", "-C", repo_dir, "add", "new_file.txt"])
-        subprocess.call(["git", "-C", repo_dir, "commit", "-m", "New commit"])
+        # Initial commit, then the clones. The observer's clone tracks the
+        # upstream branch, and it starts behind the commit made below, so
+        # that commit is seen however late the observer starts polling.
+        _git("init", "-q", origin_dir)
+        _git("-C", origin_dir, "add", ".")
+        _git("-C", origin_dir, *identity, "commit", "-q", "-m", "Initial commit")
+        _git("clone", "-q", origin_dir, observer_dir)
+        _git("clone", "-q", origin_dir, runner_dir)
+
+        # Start dispatcher, and collect its log to see the runner register.
+        dispatcher_proc = self.start(
+            "ci_system.dispatcher", "--host", "localhost", "--port", "8888",
+            stderr=subprocess.PIPE, text=True)
+        dispatcher_log = []
 
-        # Allow time for processing.
-        time.sleep(10)
+        def collect_log():
+            with dispatcher_proc.stderr:
+                dispatcher_log.extend(dispatcher_proc.stderr)
 
-        result_files = os.listdir("test_results") if os.path.exists("test_results") else []
-        self.assertTrue(len(result_files) > 0)
+        threading.Thread(target=collect_log, daemon=True).start()
+        self.assertTrue(wait_until(lambda: _port_open("localhost", 8888)))
+
+        # Start test runner and repository observer.
+        self.start("ci_system.test_runner", runner_dir, "--host", "localhost", "--port", "0",
+                   "--dispatcher-server", "localhost:8888")
+        self.start("ci_system.repo_observer", "--dispatcher-server", "localhost:8888",
+                   observer_dir)
+        self.assertTrue(wait_until(
+            lambda: any("Registered runner" in line for line in dispatcher_log)))
+
+        # Make a new commit to trigger CI.
+        with open(os.path.join(origin_dir, "new_file.txt"), "w") as f:
+            f.write("New commit content.\n")
+        _git("-C", origin_dir, "add", "new_file.txt")
+        _git("-C", origin_dir, *identity, "commit", "-q", "-m", "New commit")
+        commit_id = subprocess.check_output(
+            ["git", "-C", origin_dir, "rev-parse", "HEAD"], text=True).strip()
 
-        # Cleanup.
-        dispatcher_proc.terminate()
-        test_runner_proc.terminate()
-        observer_proc.terminate()
-        subprocess.call(["rm", "-rf", repo_dir])
+        # Wait for the results to arrive.
+        result = helpers.result_path(commit_id)
+        self.addCleanup(helpers.result_html_path(commit_id).unlink, missing_ok=True)
+        self.addCleanup(result.unlink, missing_ok=True)
+        self.assertTrue(wait_until(result.exists))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+"""
+tests/test_dispatcher.py
+
+Unit tests for the dispatcher module. The dispatcher's connection handler is
+served on an ephemeral port and driven with framed requests over asyncio
+streams, checking the replies and the bookkeeping of runners and results.
+Scheduling is checked against fake runners that answer runtest requests with
+scripted replies.
+"""
+
+import asyncio
+import html
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from ci_system import dispatcher, helpers
+
+
+class FakeRunner:
+    """A runner that answers pings, and each runtest with its next scripted reply"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.runtests = []
+        self.handlers = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "localhost", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.info = {"host": "localhost", "port": port, "last_seen": time.time()}
+
+    async def handle(self, reader, writer):
+        self.handlers.add(asyncio.current_task())
+        try:
+            while True:
+                message = (await helpers.read_message(reader)).decode()
+                if message.startswith("runtest:"):
+                    self.runtests.append(message)
+                    reply = self.replies.pop(0)
+                else:
+                    reply = "OK:pong"
+                await helpers.write_message(writer, reply.encode())
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        # Close the dispatcher's pooled connections so the handlers see EOF
+        for _, writer in helpers._async_pool.pop(("localhost", self.info["port"]), []):
+            writer.close()
+            await writer.wait_closed()
+        await asyncio.gather(*self.handlers)
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def wait_for(pred, timeout=5):
+    """Yield to the dispatcher's tasks until pred holds or timeout seconds pass"""
+    deadline = time.monotonic() + timeout
+    while not pred() and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    return pred()
+
+
+class TestDispatcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        dispatcher.registered_runners.clear()
+        dispatcher.dispatched_commits.clear()
+        dispatcher.pending_commits.clear()
+
+        # asyncio primitives bind to the loop that first waits on them; each
+        # test runs its own loop, so each gets its own lock and conditions
+        state_lock = asyncio.Lock()
+        for name, value in (("state_lock", state_lock),
+                            ("pending_cv", asyncio.Condition(state_lock)),
+                            ("runners_cv", asyncio.Condition(state_lock))):
+            patcher = mock.patch.object(dispatcher, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Server-side handler tasks, awaited on teardown so none is left
+        # pending when the test's event loop closes
+        self.handlers = set()
+
+        async def handle_connection(reader, writer):
+            self.handlers.add(asyncio.current_task())
+            await dispatcher.handle_connection(reader, writer)
+
+        self.server = await asyncio.start_server(handle_connection, "localhost", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection("localhost", self.port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        # Each handler returns once it reads the client's EOF
+        await asyncio.gather(*self.handlers)
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def request(self, message):
+        await helpers.write_message(self.writer, message.encode())
+        return (await helpers.read_message(self.reader)).decode()
+
+    async def test_status(self):
+        self.assertEqual(await self.request("status"), "OK")
+
+    async def test_unknown_command(self):
+        self.assertEqual(await self.request("bogus"), "Unknown command")
+
+    async def test_register_rejects_duplicates(self):
+        self.assertEqual(await self.request("register:localhost:9001"), "OK")
+        self.assertEqual(await self.request("register:localhost:9001"),
+                         "Runner already registered")
+        self.assertEqual(len(dispatcher.registered_runners), 1)
+
+    async def test_dispatch_without_runners(self):
+        self.assertEqual(await self.request("dispatch:abc123"), "No runners available")
+
+    async def start_runner(self, *replies):
+        runner = FakeRunner(*replies)
+        await runner.start()
+        self.addAsyncCleanup(runner.stop)
+        return runner
+
+    async def test_dispatch_retried_after_busy(self):
+        runner = await self.start_runner("OK:BUSY", "OK:OK")
+        self.assertEqual(await self.request(f"register:localhost:{runner.info['port']}"), "OK")
+        self.assertEqual(await self.request("dispatch:abc123"), "OK")
+        self.assertTrue(await wait_for(lambda: runner.runtests))
+
+        # The busy runner reporting another commit's results wakes the retry
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(dispatcher.config, "TEST_RESULTS_DIR", Path(tmp)):
+            self.assertEqual(await self.request("results:def456:3:OK\n"), "OK")
+            self.assertTrue(await wait_for(lambda: "abc123" in dispatcher.dispatched_commits))
+        self.assertEqual(runner.runtests, ["runtest:abc123"] * 2)
+        self.assertEqual(dispatcher.dispatched_commits["abc123"]["port"], runner.info["port"])
+        await asyncio.gather(*dispatcher._background_tasks)
+
+    async def test_removed_runners_commit_redispatched(self):
+        dead = await self.start_runner()
+        alive = await self.start_runner("OK:OK")
+        for runner in (dead, alive):
+            dispatcher.registered_runners[("localhost", runner.info["port"])] = runner.info
+        dispatcher.dispatched_commits["abc123"] = dead.info
+
+        redistributor = asyncio.create_task(dispatcher.redistribute(self.server))
+        try:
+            # A stale snapshot of a runner (not the registered object) is ignored
+            await dispatcher.remove_runner(dict(alive.info))
+            self.assertIn(("localhost", alive.info["port"]), dispatcher.registered_runners)
+
+            await dispatcher.remove_runner(dead.info)
+            self.assertNotIn(("localhost", dead.info["port"]), dispatcher.registered_runners)
+            self.assertTrue(await wait_for(
+                lambda: dispatcher.dispatched_commits.get("abc123") is alive.info))
+        finally:
+            redistributor.cancel()
+            await asyncio.gather(redistributor, return_exceptions=True)
+        self.assertEqual(alive.runtests, ["runtest:abc123"])
+        self.assertEqual(dead.runtests, [])
+
+    async def test_results_saved(self):
+        body = "test_a ... ok\n\nOK\n"
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(dispatcher.config, "TEST_RESULTS_DIR", Path(tmp)):
+            dispatcher.dispatched_commits["abc123"] = {"host": "localhost", "port": 9001}
+            response = await self.request(f"results:abc123:{len(body)}:{body}")
+            self.assertEqual(response, "OK")
+            self.assertEqual((Path(tmp) / "ab" / "abc123").read_text(), body)
+            self.assertEqual(sorted(p.name for p in (Path(tmp) / "ab").iterdir()),
+                             ["abc123", "abc123.html"])
+        self.assertNotIn("abc123", dispatcher.dispatched_commits)
+
+    async def test_error_report_saved(self):
+        body = "Repository update failed: bad object\n"
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(dispatcher.config, "TEST_RESULTS_DIR", Path(tmp)):
+            dispatcher.dispatched_commits["abc123"] = {"host": "localhost", "port": 9001}
+            self.assertEqual(await self.request(f"error:abc123:{len(body)}:{body}"), "OK")
+            self.assertEqual(helpers.result_path("abc123").read_text(), body)
+        self.assertNotIn("abc123", dispatcher.dispatched_commits)
+
+    async def test_results_streamed_in_chunks(self):
+        body = "é" * (dispatcher.DispatcherHandler.BUF_SIZE + 1)
+        size = len(body.encode())
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(dispatcher.config, "TEST_RESULTS_DIR", Path(tmp)):
+            self.assertEqual(await self.request(f"results:abc123:{size}:{body}"), "OK")
+            self.assertEqual(helpers.result_path("abc123").read_text(encoding="utf-8"), body)
+
+    async def test_results_html_escaped(self):
+        body = "<b>é & 'x'</b>\n" * (dispatcher.DispatcherHandler.BUF_SIZE // 8)
+        size = len(body.encode())
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(dispatcher.config, "TEST_RESULTS_DIR", Path(tmp)):
+            self.assertEqual(await self.request(f"results:abc123:{size}:{body}"), "OK")
+            self.assertEqual(helpers.result_html_path("abc123").read_text(encoding="utf-8"),
+                             html.escape(body))
+
+    async def test_invalid_commit_id_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results_dir = Path(tmp) / "results"
+            results_dir.mkdir()
+            with mock.patch.object(dispatcher.config, "TEST_RESULTS_DIR", results_dir):
+                for commit_id in ("", "../ab", "xyz123"):
+                    self.assertEqual(await self.request(f"results:{commit_id}:3:abc"),
+                                     "Invalid commit ID")
+            self.assertEqual([p.name for p in Path(tmp).rglob("*")], ["results"])
+        self.assertEqual(await self.request("dispatch"), "Invalid commit ID")
+        self.assertEqual(await self.request("dispatch:../ab"), "Invalid commit ID")
+
+    async def test_results_length_mismatch(self):
+        self.assertEqual(await self.request("results:abc123:99:short"),
+                         "Invalid length in results")
+        # The rest of the frame was skipped, so the connection is still usable
+        self.assertEqual(await self.request("status"), "OK")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+tests/test_helpers.py
+
+Unit tests for the helpers module. A small framed echo server is started in a
+background thread to check that communicate() round-trips messages and reuses
+a single pooled connection for repeated calls.
+"""
+
+import asyncio
+import socket
+import socketserver
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from ci_system import helpers
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        # Count connections so the test can verify the pool is reused.
+        self.server.connections += 1
+        while True:
+            try:
+                payload = helpers.recv_message(self.request)
+            except ConnectionError:
+                return
+            helpers.send_message(self.request, b"echo:" + payload)
+
+
+class EchoServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    connections = 0
+
+
+class TestCommunicate(unittest.TestCase):
+    def setUp(self):
+        self.server = EchoServer(("localhost", 0), EchoHandler)
+        self.host, self.port = self.server.server_address
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with helpers._pool_lock:
+            sock = helpers._pool.pop((self.host, self.port), None)
+        if sock is not None:
+            sock.close()
+
+    def test_round_trip(self):
+        self.assertEqual(helpers.communicate(self.host, self.port, "ping"), "echo:ping")
+
+    def test_connection_reused(self):
+        for _ in range(5):
+            helpers.communicate(self.host, self.port, "ping")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_name_resolved_once(self):
+        helpers._resolve.cache_clear()
+        with mock.patch("socket.getaddrinfo", wraps=socket.getaddrinfo) as getaddrinfo:
+            for _ in range(3):
+                # Drop the pooled connection so every call has to connect
+                helpers.communicate("localhost", self.port, "ping")
+                with helpers._pool_lock:
+                    helpers._pool.pop(("localhost", self.port)).close()
+        lookups = [c for c in getaddrinfo.call_args_list if c.args[0] == "localhost"]
+        self.assertEqual(len(lookups), 1)
+
+    def test_large_message(self):
+        message = "x" * 100000
+        self.assertEqual(helpers.communicate(self.host, self.port, message), "echo:" + message)
+
+    def test_async_communicate_with_file(self):
+        with tempfile.TemporaryFile() as file:
+            file.write(b"y" * 100000)
+
+            async def send():
+                response = await helpers.async_communicate(
+                    self.host, self.port, "results:", file)
+                for _, writer in helpers._async_pool.pop((self.host, self.port)):
+                    writer.close()
+                    await writer.wait_closed()
+                return response
+
+            response = asyncio.run(send())
+        self.assertEqual(response, "echo:results:" + "y" * 100000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,23 +1,41 @@
 """
 tests/test_repo_observer.py
 
-A basic test for the repository observer. It creates a temporary Git repository,
-runs the update_repo.sh script, and checks that no .commit_id file is created when
-there is no new commit.
+A basic test for the repository observer. It checks that check_for_commit()
+reports a commit pushed to the observed clone's remote, and nothing when the
+remote is unchanged.
 """
 
 import unittest
 import os
 import subprocess
+import tempfile
+
+from ci_system import repo_observer
+
+
+def commit(repo, message):
+    subprocess.check_call(["git", "-C", repo, "-c", "user.name=ci", "-c", "user.email=ci@example.com",
+                           "commit", "--allow-empty", "-q", "-m", message])
+
 
 class TestRepoObserver(unittest.TestCase):
-    def test_no_new_commit(self):
-        temp_repo = "temp_repo"
-        os.makedirs(temp_repo, exist_ok=True)
-        subprocess.call(["git", "init", temp_repo])
-        subprocess.call(["./scripts/update_repo.sh", temp_repo])
-        self.assertFalse(os.path.isfile(".commit_id"))
-        subprocess.call(["rm", "-rf", temp_repo])
+    def test_check_for_commit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            origin = os.path.join(tmp, "origin")
+            clone = os.path.join(tmp, "clone")
+            subprocess.check_call(["git", "init", "-q", origin])
+            commit(origin, "Initial commit")
+            subprocess.check_call(["git", "clone", "-q", origin, clone])
+
+            head = repo_observer._git(clone, "rev-parse", "HEAD")
+            self.assertIsNone(repo_observer.check_for_commit(clone, head))
+
+            commit(origin, "New commit")
+            new_head = repo_observer._git(origin, "rev-parse", "HEAD")
+            self.assertEqual(repo_observer.check_for_commit(clone, head), new_head)
+            self.assertEqual(repo_observer._git(clone, "rev-parse", "HEAD"), new_head)
+
 
 if __name__ == "__main__":
     unittest.main()
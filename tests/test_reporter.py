@@ -0,0 +1,153 @@
+"""
+tests/test_reporter.py
+
+Unit tests for the web reporter. Result files are written to a temporary
+TEST_RESULTS_DIR and the pages are fetched through Flask's test client.
+"""
+
+import gc
+import os
+import tempfile
+import unittest
+import warnings
+from pathlib import Path
+from unittest import mock
+
+from ci_system import reporter
+
+
+class TestReporter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.results_dir = Path(self.tmp.name)
+        patcher = mock.patch.object(reporter.config, "TEST_RESULTS_DIR", self.results_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+        self.client = reporter.app.test_client()
+
+    def write_result(self, commit_id, content):
+        path = self.results_dir / commit_id[:2] / commit_id
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+        return path
+
+    def test_index_lists_status(self):
+        self.write_result("abc123", "test_a ... ok\n\nRan 1 test\n\nOK\n")
+        self.write_result("def456", "test_a ... FAIL\n\nRan 1 test\n\nFAILED (failures=1)\n")
+        commits = {c["id"]: c["status"] for c in
+                   (reporter.get_commit_info(name) for name in ("abc123", "def456"))}
+        self.assertEqual(commits, {"abc123": "passed", "def456": "failed"})
+
+        page = self.client.get("/").data.decode()
+        self.assertIn("abc123", page)
+        self.assertIn("def456", page)
+
+    def test_index_paginates_newest_first(self):
+        # Written oldest first; equal ctimes fall back to name order, which agrees
+        for i in range(3):
+            self.write_result(f"commit{i}", "OK\n")
+        with mock.patch.object(reporter.config, "REPORTER_PAGE_SIZE", 2):
+            first = self.client.get("/").data.decode()
+            second = self.client.get("/?page=2").data.decode()
+        self.assertIn("commit2", first)
+        self.assertIn("commit1", first)
+        self.assertNotIn("commit0", first)
+        self.assertIn("commit0", second)
+        self.assertNotIn("commit1", second)
+
+    def test_index_spans_shards(self):
+        self.write_result("abc123", "OK\n")
+        self.write_result("def456", "OK\n")
+        # Temporary files and stray top-level files are not results
+        (self.results_dir / "ab" / ".ab9999.tmp").write_text("partial")
+        (self.results_dir / "stray").write_text("OK\n")
+
+        page = self.client.get("/").data.decode()
+        self.assertIn("abc123", page)
+        self.assertIn("def456", page)
+        self.assertNotIn("ab9999", page)
+        self.assertNotIn("stray", page)
+
+    def test_index_cached_until_shard_changes(self):
+        path = self.write_result("abc123", "OK\n")
+        with mock.patch.object(reporter, "SHARD_SETTLE_NS", -1):
+            self.assertIn("abc123", self.client.get("/").data.decode())
+
+            # Rendered page is reused while the shard is unchanged
+            with mock.patch.object(reporter, "_render_index") as render:
+                self.client.get("/")
+            render.assert_not_called()
+
+            self.write_result("abd456", "OK\n")
+            st = path.parent.stat()
+            os.utime(path.parent, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+            self.assertIn("abd456", self.client.get("/").data.decode())
+
+    def test_index_clamps_page_past_the_end(self):
+        self.write_result("abc123", "OK\n")
+        with mock.patch.object(reporter, "SHARD_SETTLE_NS", -1):
+            self.assertIn("abc123", self.client.get("/?page=999999").data.decode())
+        self.assertEqual(list(reporter._index_cache["pages"]),
+                         [(1, reporter.config.REPORTER_PAGE_SIZE)])
+
+    def test_show_result_escapes_content(self):
+        self.write_result("abc123", "<script>alert(1)</script>\nOK\n")
+        response = self.client.get("/results/abc123")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("&lt;script&gt;", response.data.decode())
+
+    def test_show_result_streams_large_log(self):
+        content = "line\n" * (reporter.STREAM_CHUNK_SIZE // 2) + "OK\n"
+        self.write_result("abc123", content)
+        page = self.client.get("/results/abc123").data.decode()
+        self.assertIn(content, page)
+        raw = self.client.get("/results/abc123/raw")
+        self.assertEqual(raw.mimetype, "text/plain")
+        self.assertEqual(raw.data.decode(), content)
+        raw.close()
+
+    def test_show_result_uses_stored_fragment(self):
+        self.write_result("abc123", "<b>raw</b>\nOK\n")
+        self.write_result("abc123.html", "&lt;b&gt;stored&lt;/b&gt;\nOK\n")
+        page = self.client.get("/").data.decode()
+        self.assertEqual(page.count("/results/abc123\""), 1)
+
+        page = self.client.get("/results/abc123").data.decode()
+        self.assertIn("&lt;b&gt;stored&lt;/b&gt;", page)
+        self.assertEqual(self.client.get("/results/abc123.html").status_code, 404)
+
+    def test_show_result_closes_file_on_head(self):
+        self.write_result("abc123", "OK\n")
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            self.client.head("/results/abc123").close()
+            gc.collect()
+        self.assertFalse([w for w in caught if issubclass(w.category, ResourceWarning)])
+
+    def test_missing_result(self):
+        self.assertEqual(self.client.get("/results/nope").status_code, 404)
+        self.assertEqual(self.client.get("/results/nope/raw").status_code, 404)
+
+    def test_result_outside_results_dir(self):
+        # "..x" would resolve to TEST_RESULTS_DIR/../..x
+        results_dir = self.results_dir / "results"
+        results_dir.mkdir()
+        (self.results_dir / "..x").write_text("OK\n")
+        with mock.patch.object(reporter.config, "TEST_RESULTS_DIR", results_dir):
+            self.assertIsNone(reporter.get_commit_info("..x"))
+            self.assertEqual(self.client.get("/results/..x").status_code, 404)
+            self.assertEqual(self.client.get("/results/..x/raw").status_code, 404)
+
+    def test_rewritten_result_is_reparsed(self):
+        path = self.write_result("abc123", "FAILED (errors=1)\n")
+        self.assertEqual(reporter.get_commit_info("abc123")["status"], "failed")
+
+        path.write_text("OK\n")
+        st = path.stat()
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertEqual(reporter.get_commit_info("abc123")["status"], "passed")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+tests/test_runner_manager.py
+
+Unit tests for the runner manager. Runners are replaced by an idle function
+in forked children, and a killed child is checked to be reaped and replaced.
+The manager's wait between pool checks is checked not to fail when it has no
+runners to wait on.
+"""
+
+import multiprocessing
+import time
+import unittest
+from unittest import mock
+
+from ci_system import runner_manager
+
+
+def idle_runner(*args):
+    time.sleep(60)
+
+
+class TestRunnerManager(unittest.TestCase):
+    def setUp(self):
+        self.manager = runner_manager.RunnerManager(".", "localhost:8888")
+        # Forked children run the patched target; the forkserver would
+        # import the real runner instead
+        for target, attribute, value in (
+            (runner_manager, "_mp_context", multiprocessing.get_context("fork")),
+            (runner_manager.test_runner, "run_runner", idle_runner),
+        ):
+            patcher = mock.patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.stop_runners)
+
+    def stop_runners(self):
+        for proc in self.manager.processes.values():
+            proc.terminate()
+            proc.join()
+
+    def test_killed_runner_replaced(self):
+        self.manager.maintain_pool(2)
+        self.assertEqual(len(self.manager.processes), 2)
+        killed = next(iter(self.manager.processes.values()))
+        killed_pid = killed.pid
+        killed.kill()
+
+        # The sentinel wakes the wait, and the next check reaps and respawns
+        self.manager.wait_for_exit(2)
+        self.manager.maintain_pool(2)
+        pids = [proc.pid for proc in self.manager.processes.values()]
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(killed_pid, pids)
+        self.assertTrue(all(proc.is_alive() for proc in self.manager.processes.values()))
+        with self.assertRaises(ValueError):  # Closed after being joined
+            killed.is_alive()
+
+    def test_wait_without_runners(self):
+        with mock.patch("time.sleep") as sleep:
+            self.manager.maintain_pool(0)
+            self.manager.wait_for_exit(0)
+        sleep.assert_called_once_with(runner_manager.config.RUNNER_CHECK_INTERVAL)
+
+
+if __name__ == "__main__":
+    unittest.main()
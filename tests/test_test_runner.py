@@ -1,54 +1,205 @@
 """
 tests/test_test_runner.py
 
-Unit tests for the test runner module. This test simulates a "ping" command to ensure
-the test runner responds with "pong" (with an OK prefix) for health checks.
+Unit tests for the test runner module. The runner's connection handler is served
+on an ephemeral port, and a "ping" command is sent to ensure the test runner
+responds with "pong" (with an OK prefix) for health checks. The loaded test suite
+is checked to be reused across runs until the clone's sources change, and large
+results to be queued as a file instead of inline.
 """
 
+import asyncio
+import os
+import sys
+import tempfile
 import unittest
-from ci_system import test_runner
-
-class DummyRequest:
-    def __init__(self, data):
-        # Encode the provided data to bytes as if it were coming from a socket.
-        self.data = data.encode()
-        self.response = None
-
-    def recv(self, bufsize):
-        return self.data
-
-    def sendall(self, data):
-        # Capture the sent data after decoding.
-        self.response = data.decode()
-
-class DummyTestHandler(test_runner.TestRunnerHandler):
-    def __init__(self, data, server):
-        # Bypass the normal socketserver initialization and set attributes manually.
-        self.request = DummyRequest(data)
-        self.server = server
-
-    def handle(self):
-        # Call the parent class's handle method to process the request.
-        super().handle()
-
-class DummyServer:
-    def __init__(self):
-        # Set up the dummy server with attributes expected by TestRunnerHandler.
-        self.repo_folder = "."
-        self.dispatcher_server = {"host": "localhost", "port": 8888}
-        self.last_communication = 0
-        self.busy = False
-
-class TestTestRunner(unittest.TestCase):
-    def test_ping(self):
-        # Create a dummy server instance.
-        server = DummyServer()
-        # Instantiate the DummyTestHandler with the "ping" command.
-        handler = DummyTestHandler("ping", server)
-        # Run the handler.
-        handler.handle()
-        # The _handle_ping method calls _send_response("pong"), and _send_response prefixes the message with "OK:".
-        self.assertEqual(handler.request.response, "OK:pong")
+from unittest import mock
+from ci_system import helpers, test_runner
+
+original_sleep = asyncio.sleep
+
+class TestTestRunner(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        # Set up the runner with the attributes its handlers expect, without registering.
+        self.runner = test_runner.TestRunnerServer(".", {"host": "localhost", "port": 8888})
+        # Server-side handler tasks, awaited on teardown so none is left
+        # pending when the test's event loop closes
+        self.handlers = set()
+
+        async def handle_connection(reader, writer):
+            self.handlers.add(asyncio.current_task())
+            await self.runner.handle_connection(reader, writer)
+
+        self.server = await asyncio.start_server(handle_connection, "localhost", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.reader, self.writer = await asyncio.open_connection("localhost", port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        # Each handler returns once it reads the client's EOF
+        await asyncio.gather(*self.handlers)
+        self.server.close()
+        await self.server.wait_closed()
+        self.runner.test_executor.shutdown()
+
+    async def request(self, message):
+        await helpers.write_message(self.writer, message.encode())
+        return (await helpers.read_message(self.reader)).decode()
+
+    async def test_ping(self):
+        # _handle_ping replies "pong", and _send_response prefixes the message with "OK:".
+        self.assertEqual(await self.request("ping"), "OK:pong")
+
+    async def test_runtest_while_busy(self):
+        self.runner.busy = True
+        self.assertEqual(await self.request("runtest:abc123"), "OK:BUSY")
+
+    async def test_runtest_rejects_invalid_commit_id(self):
+        for message in ("runtest", "runtest:--hard", "runtest:../x"):
+            self.assertEqual(await self.request(message), "ERROR:Invalid commit ID")
+        self.assertFalse(self.runner.busy)
+
+    async def test_reregisters_without_heartbeat(self):
+        received = []
+
+        async def fake_dispatcher(reader, writer):
+            received.append((await helpers.read_message(reader)).decode())
+            await helpers.write_message(writer, b"OK")
+            writer.close()
+
+        dispatcher = await asyncio.start_server(fake_dispatcher, "localhost", 0)
+        self.runner.dispatcher_server = {
+            "host": "localhost", "port": dispatcher.sockets[0].getsockname()[1]}
+        self.runner.last_communication = 0
+        watchdog = asyncio.create_task(self.runner._watch_dispatcher("register:localhost:9001"))
+        try:
+            while not received:
+                await asyncio.sleep(0.01)
+        finally:
+            watchdog.cancel()
+            dispatcher.close()
+            await dispatcher.wait_closed()
+        self.assertEqual(received, ["register:localhost:9001"])
+
+    async def send_queued(self, replies, *items):
+        """Run the sender against a dispatcher answering with replies, in order"""
+        replies = list(replies)
+        received = []
+
+        async def fake_dispatcher(reader, writer):
+            received.append((await helpers.read_message(reader)).decode())
+            await helpers.write_message(writer, replies.pop(0))
+            writer.close()
+
+        async def no_backoff(delay):
+            await original_sleep(0)
+
+        dispatcher = await asyncio.start_server(fake_dispatcher, "localhost", 0)
+        self.runner.dispatcher_server = {
+            "host": "localhost", "port": dispatcher.sockets[0].getsockname()[1]}
+        for item in items:
+            self.runner.results_queue.put_nowait(item)
+        with mock.patch("asyncio.sleep", new=no_backoff):
+            sender = asyncio.create_task(self.runner._send_results())
+            try:
+                for _ in range(500):
+                    if not replies:
+                        break
+                    await original_sleep(0.01)
+            finally:
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
+                for _, writer in helpers._async_pool.pop(
+                        ("localhost", self.runner.dispatcher_server["port"]), []):
+                    writer.close()
+                    await writer.wait_closed()
+                dispatcher.close()
+                await dispatcher.wait_closed()
+        return received
+
+    async def test_results_resent_until_accepted(self):
+        received = await self.send_queued(
+            [b"Error saving results: disk full", b"OK"],
+            ("abc123", "results:abc123:2:OK", None))
+        self.assertEqual(received, ["results:abc123:2:OK"] * 2)
+
+    async def test_rejected_results_dropped(self):
+        rejected = tempfile.TemporaryFile()
+        rejected.write(b"OK")
+        received = await self.send_queued(
+            [b"Invalid commit ID", b"OK"],
+            ("zz", "results:zz:2:", rejected),
+            ("abc123", "results:abc123:2:OK", None))
+        self.assertEqual(received, ["results:zz:2:OK", "results:abc123:2:OK"])
+        self.assertTrue(rejected.closed)
+
+    async def test_large_results_queued_as_file(self):
+        handler = test_runner.TestRunnerHandler(self.runner, None, None)
+        for size in (10, test_runner.config.RESULTS_SPOOL_SIZE + 1):
+            output = tempfile.SpooledTemporaryFile(
+                max_size=test_runner.config.RESULTS_SPOOL_SIZE)
+            output.write(b"x" * size)
+            handler._report_results("abc123", output)
+            _, message, file = self.runner.results_queue.get_nowait()
+            if file is None:
+                self.assertEqual(message, f"results:abc123:{size}:" + "x" * size)
+            else:
+                self.assertEqual(message, f"results:abc123:{size}:")
+                file.close()
+            self.assertEqual(file is None, size == 10)
+
+class TestSuiteCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        os.mkdir(os.path.join(self.tmp.name, "tests"))
+        self.test_file = os.path.join(self.tmp.name, "tests", "test_cached_sample.py")
+        self.server = test_runner.TestRunnerServer(self.tmp.name, {})
+        self.addCleanup(self.server.test_executor.shutdown)
+        self.handler = test_runner.TestRunnerHandler(self.server, None, None)
+        self.addCleanup(test_runner._purge_modules, self.tmp.name)
+
+    def write_test(self, body):
+        with open(self.test_file, "w") as f:
+            f.write("import unittest\n"
+                    "class T(unittest.TestCase):\n"
+                    f"    def test_sample(self): {body}\n")
+        # Make sure the rewrite is visible even within one timestamp tick
+        st = os.stat(self.test_file)
+        os.utime(self.test_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    def run_suite(self):
+        with self.handler._run_test_suite() as output:
+            output.seek(0)
+            return output.read().decode()
+
+    def test_suite_reused_until_sources_change(self):
+        self.write_test("pass")
+        self.assertIn("OK", self.run_suite())
+
+        # Unchanged sources: the loaded suite is run again without rediscovery
+        with mock.patch.object(unittest.TestLoader, "discover") as discover:
+            self.assertIn("OK", self.run_suite())
+        discover.assert_not_called()
+
+        # A changed file is rediscovered and re-imported, not served stale
+        self.write_test("self.fail('changed')")
+        self.assertIn("FAILED", self.run_suite())
+
+    def test_purge_keeps_runner_package(self):
+        self.write_test("pass")
+        self.run_suite()
+        self.assertIn("test_cached_sample", sys.modules)
+
+        # Stand the sample's directory in for the runner's package, as when
+        # the clone is at or above the runner's own checkout
+        with mock.patch.object(test_runner, "_OWN_PACKAGE",
+                               os.path.realpath(os.path.join(self.tmp.name, "tests")) + os.sep):
+            test_runner._purge_modules(self.tmp.name)
+        self.assertIn("test_cached_sample", sys.modules)
+        test_runner._purge_modules(self.tmp.name)
+        self.assertNotIn("test_cached_sample", sys.modules)
 
 if __name__ == "__main__":
     unittest.main()